@@ -1,28 +1,36 @@
+import asyncio
+import math
 import os
 from contextlib import asynccontextmanager
+from typing import AsyncIterator
 
-from fastapi import FastAPI, HTTPException
-from fastapi import Depends
+from fastapi import FastAPI, HTTPException, WebSocket
+from fastapi import Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
-import sentry_sdk
 from starlette.requests import Request
 from starlette.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
-# Initialize Sentry before any other application imports
-sentry_sdk.init(
-    dsn=os.getenv("SENTRY_DSN"),
-    # Add data like request headers and IP for users, if applicable;
-    # see https://docs.sentry.io/platforms/python/data-management/data-collected/ for more info
-    send_default_pii=True,
-    traces_sample_rate=0,
-    profile_session_sample_rate=0,
-    profile_lifecycle="manual",
-)
+# Initialize Sentry before any other application imports. The SDK is only
+# imported when a DSN is configured, so runs without Sentry skip its import cost.
+if os.getenv("SENTRY_DSN"):
+    import sentry_sdk
+
+    sentry_sdk.init(
+        dsn=os.getenv("SENTRY_DSN"),
+        # Add data like request headers and IP for users, if applicable;
+        # see https://docs.sentry.io/platforms/python/data-management/data-collected/ for more info
+        send_default_pii=True,
+        traces_sample_rate=0,
+        profile_session_sample_rate=0,
+        profile_lifecycle="manual",
+    )
 
-from app.aitabbble.db import get_db_session
+from app.aitabbble.db import get_db_session, get_sessionmaker
 from app.aitabbble.chat import service as chat_service
+from app.aitabbble.chat.streaming import StreamBudget, guard_stream
 from app.aitabbble.schema import (
+    MessageContentResponse,
     MessageCreateRequest,
     MessageCreateUpdateResponse,
     MessageListResponse,
@@ -30,26 +38,49 @@ from app.aitabbble.schema import (
     ThreadUpdateRequest,
     ThreadListResponse,
     ThreadCreateUpdateResponse,
+    ThreadSummaryListResponse,
+    RequestProfileListResponse,
+    RequestProfileResponse,
 )
 
 from app.aitabbble.config import logger, settings  # noqa: E402
-from app.aitabbble.db import create_tables
+from app.aitabbble.db import create_tables, dispose_engine
+from app.aitabbble.limits import LimitTimeoutError
+from app.aitabbble.resilience import CircuitOpenError, openai_breaker
+from app.aitabbble.serialization import ModelResponse, stream_json_array
 from app.aitabbble.openai_client import (
-    calculate_with_openai,
-    parse_result_value,
+    close_openai_client,
     stream_chat,
 )  # noqa: E402
-from app.aitabbble.schema import CalculationRequest, CalculationResponse, ChatRequest  # noqa: E402
+from app.aitabbble.schema import (  # noqa: E402
+    CalculationBatchRequest,
+    CalculationBatchResponse,
+    CalculationRequest,
+    CalculationResponse,
+    ChatRequest,
+)
+from app.aitabbble.speculation import calculate_cell  # noqa: E402
+from app.aitabbble.channel import Channel  # noqa: E402
+from app.aitabbble.profiling import (  # noqa: E402
+    ProfiledRoute,
+    ProfilingMiddleware,
+    is_admin,
+    profile_store,
+)
+from app.aitabbble import batch  # noqa: E402
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup
+    # Startup. The OpenAI client and the database engine are created lazily on
+    # first use, so every worker process owns its own connections.
     if settings.environment == "local":
         logger.info("Creating tables...")
         await create_tables()
     yield
-    # Shutdown (if needed)
+    # Shutdown
+    await close_openai_client()
+    await dispose_engine()
 
 
 # Initialize FastAPI app
@@ -59,6 +90,8 @@ app = FastAPI(
     version="1.0.0",
     lifespan=lifespan,
 )
+# time body parsing and validation for requests being profiled
+app.router.route_class = ProfiledRoute
 
 # Configure CORS
 app.add_middleware(
@@ -69,19 +102,31 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(ProfilingMiddleware)
+
 
 @app.post("/api/calculate", response_model=CalculationResponse)
 async def calculate_cell_value(request: CalculationRequest):
     """Calculate a cell value using OpenAI based on the provided formula and spreadsheet context."""
     try:
-        # Call OpenAI to calculate the value
-        calculated_value = await calculate_with_openai(request)
-
-        # Parse the result into appropriate type
-        result = parse_result_value(calculated_value)
+        result = await calculate_cell(request)
 
-        return CalculationResponse(result=result)
+        return ModelResponse(CalculationResponse(result=result))
 
+    except CircuitOpenError as e:
+        logger.warning(f"Rejecting calculation: {str(e)}")
+        raise HTTPException(
+            status_code=503,
+            detail="AI service is temporarily unavailable, please retry later",
+            headers={"Retry-After": str(math.ceil(e.retry_after))},
+        )
+    except LimitTimeoutError as e:
+        logger.warning(f"Rejecting calculation: {str(e)}")
+        raise HTTPException(
+            status_code=503,
+            detail="AI service is busy, please retry later",
+            headers={"Retry-After": str(math.ceil(e.retry_after))},
+        )
     except Exception as e:
         logger.error(f"Error during calculation: {str(e)}")
         raise HTTPException(
@@ -89,9 +134,86 @@ async def calculate_cell_value(request: CalculationRequest):
         )
 
 
+def _batch_api_error(e: Exception) -> Exception:
+    """Map an OpenAI error from the batch endpoints to an HTTP error."""
+    # openai is imported lazily to keep it off the startup path
+    from openai import APIStatusError, NotFoundError
+
+    if isinstance(e, NotFoundError):
+        return HTTPException(status_code=404, detail="Batch not found")
+    if isinstance(e, APIStatusError):
+        logger.error(f"OpenAI batch API error: {str(e)}")
+        return HTTPException(
+            status_code=502, detail=f"OpenAI batch API error: {e.message}"
+        )
+    return e
+
+
+@app.post("/api/calculate/batch", response_model=CalculationBatchResponse)
+async def submit_calculation_batch(request: CalculationBatchRequest):
+    """Submit many cell calculations as OpenAI batches.
+
+    Batches finish within a day at a lower price than `/api/calculate`; poll
+    `/api/calculate/batch/{batch_id}` for the results. Submissions over the
+    Batch API limits are split into several batches, listed in `batches` and
+    tracked together under the returned `batch.id`.
+    """
+    try:
+        batches = await batch.submit_calculation_batch(
+            request.requests, batch.OpenAIBatchTransport()
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise _batch_api_error(e)
+    return ModelResponse(
+        CalculationBatchResponse(batch=batch.combine_batches(batches), batches=batches)
+    )
+
+
+@app.get("/api/calculate/batch/{batch_id}", response_model=CalculationBatchResponse)
+async def get_calculation_batch(batch_id: str):
+    transport = batch.OpenAIBatchTransport()
+    try:
+        batches = await batch.retrieve_calculation_batches(batch_id, transport)
+        batch_job = batch.combine_batches(batches)
+        results = None
+        if batch_job.status in batch.TERMINAL_STATUSES:
+            results = await batch.collect_calculation_batches(batches, transport)
+    except Exception as e:
+        raise _batch_api_error(e)
+    return ModelResponse(
+        CalculationBatchResponse(batch=batch_job, batches=batches, results=results)
+    )
+
+
 @app.post("/api/chat")
-async def chat(request: ChatRequest):
-    return StreamingResponse(stream_chat(request), media_type="text/event-stream")
+async def chat(
+    request: ChatRequest,
+    raw_request: Request,
+    db_session: AsyncSession = Depends(get_db_session),
+):
+    if not openai_breaker.allows_call():
+        raise HTTPException(
+            status_code=503,
+            detail="AI service is temporarily unavailable, please retry later",
+            headers={"Retry-After": str(math.ceil(openai_breaker.retry_after()))},
+        )
+    # stored history arrives with previews of its large values
+    request.messages = await chat_service.expand_chat_messages(
+        db_session, request.messages
+    )
+    budget = StreamBudget()
+    return StreamingResponse(
+        guard_stream(raw_request, stream_chat(request, budget), budget),
+        media_type="text/event-stream",
+    )
+
+
+@app.websocket("/api/ws")
+async def channel(websocket: WebSocket):
+    """Calculations, cell recalculations and chat multiplexed over one connection."""
+    await Channel(websocket).run()
 
 
 @app.get("/health")
@@ -105,7 +227,7 @@ async def create_thread(
     request: ThreadCreateRequest, db_session: AsyncSession = Depends(get_db_session)
 ):
     new_thread = await chat_service.create_thread(db_session, request)
-    return new_thread
+    return ModelResponse(new_thread)
 
 
 @app.put("/api/thread", response_model=ThreadCreateUpdateResponse)
@@ -113,13 +235,21 @@ async def update_thread(
     request: ThreadUpdateRequest, db_session: AsyncSession = Depends(get_db_session)
 ):
     updated_thread = await chat_service.update_thread(db_session, request)
-    return updated_thread
+    return ModelResponse(updated_thread)
 
 
 @app.get("/api/threads", response_model=ThreadListResponse)
 async def list_threads(db_session: AsyncSession = Depends(get_db_session)):
     threads = await chat_service.list_threads(db_session)
-    return threads
+    return ModelResponse(threads)
+
+
+@app.get("/api/threads/summary", response_model=ThreadSummaryListResponse)
+async def list_thread_summaries(
+    include_archived: bool = False, db_session: AsyncSession = Depends(get_db_session)
+):
+    summaries = await chat_service.list_thread_summaries(db_session, include_archived)
+    return ModelResponse(summaries)
 
 
 @app.post("/api/message", response_model=MessageCreateUpdateResponse)
@@ -127,15 +257,94 @@ async def create_message(
     request: MessageCreateRequest, db_session: AsyncSession = Depends(get_db_session)
 ):
     new_message = await chat_service.create_message(db_session, request)
-    return new_message
+    return ModelResponse(new_message)
 
 
 @app.get("/api/messages", response_model=MessageListResponse)
-async def list_messages(
-    request: Request, db_session: AsyncSession = Depends(get_db_session)
-):
+async def list_messages(request: Request):
+    """List the messages of a thread.
+
+    Large content values are returned as previews, referenced under `_refs`
+    in their content part. Pass `expand=true` to inline the full values, or
+    fetch them one by one from `/api/message/content/{hash}`.
+
+    The body is streamed, so `response_model` only documents its shape in the
+    OpenAPI schema.
+    """
     thread_id = request.query_params.get("thread_id")
     if not thread_id:
         raise HTTPException(status_code=400, detail="thread_id is required")
-    messages_list = await chat_service.list_messages(db_session, thread_id)
-    return messages_list
+    expand = request.query_params.get("expand", "").lower() in ("1", "true")
+
+    # the session is owned by the stream as it outlives the endpoint call
+    db_session = get_sessionmaker()()
+    messages = chat_service.stream_messages(db_session, thread_id, expand)
+    try:
+        # run the query before the response starts, so a failure still gets
+        # an error status instead of a truncated body
+        first = await anext(messages, None)
+    except Exception as e:
+        await messages.aclose()
+        await db_session.close()
+        logger.error(f"Error listing messages: {str(e)}")
+        raise HTTPException(
+            status_code=500, detail=f"Failed to list messages: {str(e)}"
+        )
+    return StreamingResponse(
+        _stream_thread_messages(db_session, messages, first),
+        media_type="application/json",
+    )
+
+
+async def _stream_thread_messages(
+    db_session: AsyncSession, messages: AsyncIterator[dict], first: dict | None
+):
+    async def rows():
+        if first is None:
+            return
+        yield first
+        async for message in messages:
+            yield message
+
+    try:
+        async for chunk in stream_json_array("messages", rows()):
+            yield chunk
+    finally:
+        await messages.aclose()
+        await db_session.close()
+
+
+@app.get("/api/message/content/{content_hash}", response_model=MessageContentResponse)
+async def get_message_content(
+    content_hash: str, db_session: AsyncSession = Depends(get_db_session)
+):
+    content = await chat_service.get_message_content(db_session, content_hash)
+    return ModelResponse(content)
+
+
+def require_admin(x_admin_token: str | None = Header(None)):
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+
+@app.get(
+    "/api/admin/profiles",
+    response_model=RequestProfileListResponse,
+    dependencies=[Depends(require_admin)],
+)
+async def list_request_profiles(limit: int = 50):
+    """List the most recent request profiles, newest first."""
+    profiles = await asyncio.to_thread(profile_store.list, limit)
+    return ModelResponse(RequestProfileListResponse(profiles=profiles))
+
+
+@app.get(
+    "/api/admin/profiles/{profile_id}",
+    response_model=RequestProfileResponse,
+    dependencies=[Depends(require_admin)],
+)
+async def get_request_profile(profile_id: str):
+    profile = await asyncio.to_thread(profile_store.get, profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return ModelResponse(profile)
@@ -0,0 +1,342 @@
+"""Bulk cell calculation through the OpenAI Batch API.
+
+For nightly or very large recalculations latency does not matter, so the
+calculation requests are written to batch input files, submitted as batches
+and their results are parsed once the batches complete. Batches are
+processed within a day at a fraction of the synchronous price.
+
+A batch holds at most `openai_batch_max_requests` requests and
+`openai_batch_max_bytes` of input, so larger submissions are split over
+several batches. They are tracked together under one id listing all of
+them, see `combine_batches`.
+
+The upload, submit, poll and download steps go through a `BatchTransport`,
+so the flow can run against OpenAI or against a local stub.
+
+Usage:
+    cd backend
+    python -m app.aitabbble.batch requests.json results.json
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from typing import Callable, List, Protocol
+
+from app.aitabbble.config import logger, settings
+from app.aitabbble.openai_client import (
+    calculation_completion_params,
+    get_openai_client,
+    parse_result_value,
+)
+from app.aitabbble.schema import (
+    BatchCellResult,
+    BatchStatus,
+    CalculationRequest,
+)
+from app.aitabbble.serialization import dumps
+
+COMPLETIONS_ENDPOINT = "/v1/chat/completions"
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+BATCH_ID_SEPARATOR = ","
+
+
+class BatchTransport(Protocol):
+    """Moves batch files and batch jobs between the backend and a batch service."""
+
+    async def upload(self, content: bytes) -> str:
+        """Upload a batch input file and return its file id."""
+        ...
+
+    async def create(self, input_file_id: str) -> BatchStatus: ...
+
+    async def retrieve(self, batch_id: str) -> BatchStatus: ...
+
+    async def download(self, file_id: str) -> bytes: ...
+
+
+class OpenAIBatchTransport:
+    """Transport backed by the OpenAI Files and Batches APIs."""
+
+    def __init__(self, completion_window: str = "24h"):
+        self.completion_window = completion_window
+
+    @staticmethod
+    def _status(batch) -> BatchStatus:
+        return BatchStatus(
+            id=batch.id,
+            status=batch.status,
+            output_file_id=batch.output_file_id,
+            error_file_id=batch.error_file_id,
+        )
+
+    async def upload(self, content: bytes) -> str:
+        uploaded = await get_openai_client().files.create(
+            file=("calculations.jsonl", content), purpose="batch"
+        )
+        return uploaded.id
+
+    async def create(self, input_file_id: str) -> BatchStatus:
+        batch = await get_openai_client().batches.create(
+            input_file_id=input_file_id,
+            endpoint=COMPLETIONS_ENDPOINT,
+            completion_window=self.completion_window,
+        )
+        return self._status(batch)
+
+    async def retrieve(self, batch_id: str) -> BatchStatus:
+        return self._status(await get_openai_client().batches.retrieve(batch_id))
+
+    async def download(self, file_id: str) -> bytes:
+        response = await get_openai_client().files.content(file_id)
+        return response.content
+
+
+class LocalBatchTransport:
+    """In-process stub that completes every batch immediately.
+
+    `respond` receives the body of each request line and returns the
+    completion text, which makes it easy to exercise the batch flow offline.
+    """
+
+    def __init__(self, respond: Callable[[dict], str]):
+        self.respond = respond
+        self._files: dict[str, bytes] = {}
+        self._batches: dict[str, BatchStatus] = {}
+
+    def _store(self, content: bytes) -> str:
+        file_id = f"file-local-{len(self._files)}"
+        self._files[file_id] = content
+        return file_id
+
+    async def upload(self, content: bytes) -> str:
+        return self._store(content)
+
+    async def create(self, input_file_id: str) -> BatchStatus:
+        output_lines = []
+        for line in self._files[input_file_id].decode().splitlines():
+            request = json.loads(line)
+            content = self.respond(request["body"])
+            output_lines.append(
+                dumps(
+                    {
+                        "custom_id": request["custom_id"],
+                        "response": {
+                            "status_code": 200,
+                            "body": {
+                                "choices": [{"message": {"content": content}}]
+                            },
+                        },
+                        "error": None,
+                    }
+                )
+            )
+        batch = BatchStatus(
+            id=f"batch-local-{len(self._batches)}",
+            status="completed",
+            output_file_id=self._store("\n".join(output_lines).encode()),
+        )
+        self._batches[batch.id] = batch
+        return batch
+
+    async def retrieve(self, batch_id: str) -> BatchStatus:
+        return self._batches[batch_id]
+
+    async def download(self, file_id: str) -> bytes:
+        return self._files[file_id]
+
+
+def cell_custom_id(request: CalculationRequest) -> str:
+    return dumps([request.target_cell.row_id, request.target_cell.column_id])
+
+
+def build_batch_inputs(
+    requests: List[CalculationRequest],
+    max_requests: int = settings.openai_batch_max_requests,
+    max_bytes: int = settings.openai_batch_max_bytes,
+) -> List[bytes]:
+    """Encode calculation requests as batch input files, one request per line.
+
+    The requests are split over as many files as needed to keep each within
+    `max_requests` lines and `max_bytes`.
+    """
+    files = []
+    lines = []
+    size = 0
+    seen = set()
+    for request in requests:
+        custom_id = cell_custom_id(request)
+        if custom_id in seen:
+            raise ValueError(f"Duplicate target cell in batch: {custom_id}")
+        seen.add(custom_id)
+        line = dumps(
+            {
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": COMPLETIONS_ENDPOINT,
+                "body": calculation_completion_params(request),
+            }
+        ).encode()
+        if len(line) > max_bytes:
+            raise ValueError(
+                f"Calculation request for cell {custom_id} is larger than the "
+                f"batch limit of {max_bytes} bytes"
+            )
+        # lines are joined by a newline
+        if lines and (len(lines) >= max_requests or size + 1 + len(line) > max_bytes):
+            files.append(b"\n".join(lines))
+            lines = []
+            size = 0
+        size += len(line) + (1 if lines else 0)
+        lines.append(line)
+    if lines:
+        files.append(b"\n".join(lines))
+    return files
+
+
+def parse_batch_output(content: bytes) -> List[BatchCellResult]:
+    """Parse batch output or error file lines into cell results."""
+    results = []
+    for line in content.decode().splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        row_id, column_id = json.loads(item["custom_id"])
+        response = item.get("response") or {}
+        error = item.get("error")
+        if error or response.get("status_code") != 200:
+            message = (error or {}).get("message") or (
+                response.get("body", {}).get("error", {}).get("message")
+            )
+            results.append(
+                BatchCellResult(
+                    custom_id=item["custom_id"],
+                    row_id=row_id,
+                    column_id=column_id,
+                    error=message or f"status {response.get('status_code')}",
+                )
+            )
+            continue
+        content_text = response["body"]["choices"][0]["message"]["content"] or ""
+        results.append(
+            BatchCellResult(
+                custom_id=item["custom_id"],
+                row_id=row_id,
+                column_id=column_id,
+                result=parse_result_value(content_text),
+            )
+        )
+    return results
+
+
+def combine_batches(batches: List[BatchStatus]) -> BatchStatus:
+    """Status of a submission split over `batches`, under an id listing all of them.
+
+    It is final once every batch is, and completed only if all of them
+    completed. A single batch is returned as it is.
+    """
+    if len(batches) == 1:
+        return batches[0]
+    statuses = {batch.status for batch in batches}
+    if not statuses <= TERMINAL_STATUSES:
+        status = "in_progress"
+    elif len(statuses) == 1:
+        (status,) = statuses
+    else:
+        status = "failed"
+    return BatchStatus(
+        id=BATCH_ID_SEPARATOR.join(batch.id for batch in batches), status=status
+    )
+
+
+async def submit_calculation_batch(
+    requests: List[CalculationRequest], transport: BatchTransport
+) -> List[BatchStatus]:
+    """Upload the requests and start as many batches as they need.
+
+    All input files are built before anything is uploaded, so invalid or
+    oversized requests fail without starting any batch.
+    """
+    if not requests:
+        raise ValueError("A batch needs at least one calculation request")
+    batches = []
+    for content in build_batch_inputs(requests):
+        input_file_id = await transport.upload(content)
+        batches.append(await transport.create(input_file_id))
+    logger.info(
+        f"Submitted {len(requests)} cells as calculation batches "
+        f"{', '.join(batch.id for batch in batches)}"
+    )
+    return batches
+
+
+async def retrieve_calculation_batches(
+    batch_id: str, transport: BatchTransport
+) -> List[BatchStatus]:
+    """Current status of every batch listed in a combined batch id."""
+    return list(
+        await asyncio.gather(
+            *(transport.retrieve(part) for part in batch_id.split(BATCH_ID_SEPARATOR))
+        )
+    )
+
+
+async def collect_calculation_batches(
+    batches: List[BatchStatus], transport: BatchTransport
+) -> List[BatchCellResult]:
+    """Download and parse the results of finished batches."""
+    results = []
+    for batch in batches:
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                results.extend(parse_batch_output(await transport.download(file_id)))
+    return results
+
+
+async def run_calculation_batch(
+    requests: List[CalculationRequest],
+    transport: BatchTransport,
+    poll_interval: float = settings.openai_batch_poll_interval,
+    timeout: float | None = None,
+) -> List[BatchCellResult]:
+    """Submit the batches, wait until they finish and return the parsed results."""
+    batches = await submit_calculation_batch(requests, transport)
+    combined = combine_batches(batches)
+    started = time.monotonic()
+    while combined.status not in TERMINAL_STATUSES:
+        if timeout is not None and time.monotonic() - started > timeout:
+            raise TimeoutError(
+                f"Batch {combined.id} still {combined.status} after {timeout}s"
+            )
+        await asyncio.sleep(poll_interval)
+        batches = await retrieve_calculation_batches(combined.id, transport)
+        combined = combine_batches(batches)
+        logger.info(f"Calculation batch {combined.id} is {combined.status}")
+    if combined.status != "completed":
+        logger.error(f"Calculation batch {combined.id} finished as {combined.status}")
+    return await collect_calculation_batches(batches, transport)
+
+
+async def _main(input_path: str, output_path: str, poll_interval: float):
+    with open(input_path) as f:
+        payload = json.load(f)
+    requests = [CalculationRequest.model_validate(item) for item in payload]
+    results = await run_calculation_batch(
+        requests, OpenAIBatchTransport(), poll_interval=poll_interval
+    )
+    with open(output_path, "w") as f:
+        f.write(dumps([result.model_dump() for result in results]))
+    failed = sum(1 for result in results if result.error)
+    logger.info(f"Wrote {len(results)} results to {output_path}, {failed} failed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recalculate cells via the OpenAI Batch API")
+    parser.add_argument("input", help="JSON list of calculation requests")
+    parser.add_argument("output", help="where to write the JSON list of cell results")
+    parser.add_argument(
+        "--poll-interval", type=float, default=settings.openai_batch_poll_interval
+    )
+    args = parser.parse_args()
+    asyncio.run(_main(args.input, args.output, args.poll_interval))
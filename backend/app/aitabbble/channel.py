@@ -0,0 +1,257 @@
+"""Multiplexed WebSocket channel for calculations and chat.
+
+A client keeps a single WebSocket open and sends JSON messages tagged with its
+own request `id`:
+
+    {"id": "1", "type": "calculate", "request": {...CalculationRequest}}
+    {"id": "2", "type": "recalculate", "requests": [{...CalculationRequest}, ...]}
+    {"id": "3", "type": "chat", "request": {...ChatRequest}}
+    {"id": "3", "type": "cancel"}
+
+Requests run concurrently and every server message carries the id it belongs
+to:
+
+    {"id": "1", "type": "result", "result": ...}
+    {"id": "2", "type": "cell", "row_id": ..., "column_id": ..., "result": ...}
+    {"id": "3", "type": "chat", "frame": {...chat stream frame}}
+    {"id": "2", "type": "done"}
+    {"id": "3", "type": "cancelled"}
+    {"id": "1", "type": "error", "status": 503, "detail": ..., "retry_after": 4}
+
+The server only sends messages in reply to requests made on the connection;
+there are no unsolicited pushes. Recalculated cells are streamed one by one
+as soon as each of them is ready, in reply to `recalculate`. Outgoing messages pass through a bounded queue, so a client that reads
+slowly pauses the work producing them, and each connection accepts a
+limited number of requests in flight before rejecting new ones with 429.
+"""
+
+import asyncio
+import json
+import math
+from typing import Any, Awaitable, Callable
+
+from pydantic import ValidationError
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+from app.aitabbble.chat import service as chat_service
+from app.aitabbble.chat.streaming import StreamBudget, guard_stream
+from app.aitabbble.config import logger, settings
+from app.aitabbble.db import get_sessionmaker
+from app.aitabbble.limits import LimitTimeoutError
+from app.aitabbble.openai_client import stream_chat
+from app.aitabbble.resilience import CircuitOpenError, openai_breaker
+from app.aitabbble.schema import CalculationRequest, ChatRequest
+from app.aitabbble.serialization import dumps
+from app.aitabbble.speculation import calculate_cell
+
+
+class ChannelRequestError(Exception):
+    """Raised for a channel request that is malformed or cannot be accepted."""
+
+    def __init__(self, status: int, detail: str):
+        self.status = status
+        self.detail = detail
+        super().__init__(detail)
+
+
+class Channel:
+    """One client connection carrying many concurrent requests."""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        send_queue_size: int = settings.channel_send_queue_size,
+        max_inflight: int = settings.channel_max_inflight,
+        recalculate_concurrency: int = settings.channel_recalculate_concurrency,
+    ):
+        self.websocket = websocket
+        self.max_inflight = max_inflight
+        self.recalculate_concurrency = recalculate_concurrency
+        self._outbox: asyncio.Queue[str] = asyncio.Queue(maxsize=send_queue_size)
+        self._requests: dict[str, asyncio.Task] = {}
+        self._closed = False
+        self._handlers: dict[str, Callable[[str, dict], Awaitable[None]]] = {
+            "calculate": self._calculate,
+            "recalculate": self._recalculate,
+            "chat": self._chat,
+        }
+
+    async def is_disconnected(self) -> bool:
+        return self._closed
+
+    async def send(self, request_id: str | None, message_type: str, **fields: Any):
+        """Queue a message, waiting while the client is behind on reading."""
+        await self.send_encoded(
+            dumps({"id": request_id, "type": message_type, **fields})
+        )
+
+    async def send_encoded(self, message: str):
+        await self._outbox.put(message)
+
+    async def _write(self):
+        while True:
+            message = await self._outbox.get()
+            await self.websocket.send_text(message)
+
+    async def run(self):
+        """Serve the connection until the client disconnects."""
+        await self.websocket.accept()
+        writer = asyncio.create_task(self._write())
+        try:
+            while True:
+                try:
+                    text = await self.websocket.receive_text()
+                except WebSocketDisconnect:
+                    break
+                await self._dispatch(text)
+        finally:
+            self._closed = True
+            requests = list(self._requests.values())
+            for task in requests:
+                task.cancel()
+            await asyncio.gather(*requests, return_exceptions=True)
+            writer.cancel()
+            await asyncio.gather(writer, return_exceptions=True)
+            if requests:
+                logger.info(
+                    f"Channel closed, cancelled {len(requests)} requests in flight"
+                )
+
+    async def _dispatch(self, text: str):
+        try:
+            message = json.loads(text)
+        except json.JSONDecodeError:
+            await self.send(None, "error", status=400, detail="Invalid JSON message")
+            return
+        if not isinstance(message, dict):
+            await self.send(None, "error", status=400, detail="Expected a JSON object")
+            return
+
+        request_id = message.get("id")
+        message_type = message.get("type")
+        if message_type == "cancel":
+            task = self._requests.get(request_id)
+            if task is not None:
+                task.cancel()
+            return
+
+        handler = self._handlers.get(message_type)
+        if not isinstance(request_id, str) or not request_id:
+            detail = "Missing request id"
+        elif request_id in self._requests:
+            detail = f"Request id {request_id} is already in flight"
+        elif handler is None:
+            detail = f"Unknown message type: {message_type}"
+        else:
+            detail = None
+        if detail:
+            await self.send(request_id, "error", status=400, detail=detail)
+            return
+        if len(self._requests) >= self.max_inflight:
+            await self.send(
+                request_id,
+                "error",
+                status=429,
+                detail=f"Too many requests in flight, at most {self.max_inflight}",
+            )
+            return
+
+        task = asyncio.create_task(self._handle(request_id, handler, message))
+        self._requests[request_id] = task
+        task.add_done_callback(lambda _: self._requests.pop(request_id, None))
+
+    async def _handle(
+        self,
+        request_id: str,
+        handler: Callable[[str, dict], Awaitable[None]],
+        message: dict,
+    ):
+        try:
+            await handler(request_id, message)
+        except asyncio.CancelledError:
+            if not self._closed:
+                await self.send(request_id, "cancelled")
+            raise
+        except ValidationError as e:
+            await self.send(
+                request_id,
+                "error",
+                status=422,
+                detail=e.errors(
+                    include_url=False, include_context=False, include_input=False
+                ),
+            )
+        except ChannelRequestError as e:
+            await self.send(request_id, "error", status=e.status, detail=e.detail)
+        except CircuitOpenError as e:
+            logger.warning(f"Rejecting channel request: {str(e)}")
+            await self.send(
+                request_id,
+                "error",
+                status=503,
+                detail="AI service is temporarily unavailable, please retry later",
+                retry_after=math.ceil(e.retry_after),
+            )
+        except LimitTimeoutError as e:
+            logger.warning(f"Rejecting channel request: {str(e)}")
+            await self.send(
+                request_id,
+                "error",
+                status=503,
+                detail="AI service is busy, please retry later",
+                retry_after=math.ceil(e.retry_after),
+            )
+        except Exception as e:
+            logger.error(f"Error during channel request: {str(e)}")
+            await self.send(
+                request_id, "error", status=500, detail=f"Request failed: {str(e)}"
+            )
+
+    async def _calculate(self, request_id: str, message: dict):
+        request = CalculationRequest.model_validate(message.get("request"))
+        result = await calculate_cell(request)
+        await self.send(request_id, "result", result=result)
+
+    async def _recalculate(self, request_id: str, message: dict):
+        requests = message.get("requests")
+        if not isinstance(requests, list):
+            raise ChannelRequestError(400, "Expected a list of requests")
+        requests = [CalculationRequest.model_validate(item) for item in requests]
+        semaphore = asyncio.Semaphore(self.recalculate_concurrency)
+
+        async def recalculate_cell(request: CalculationRequest):
+            target_cell = {
+                "row_id": request.target_cell.row_id,
+                "column_id": request.target_cell.column_id,
+            }
+            try:
+                async with semaphore:
+                    result = await calculate_cell(request)
+            except Exception as e:
+                await self.send(request_id, "cell", **target_cell, error=str(e))
+                return
+            await self.send(request_id, "cell", **target_cell, result=result)
+
+        cells = [asyncio.create_task(recalculate_cell(request)) for request in requests]
+        try:
+            await asyncio.gather(*cells)
+        finally:
+            for cell in cells:
+                cell.cancel()
+        await self.send(request_id, "done")
+
+    async def _chat(self, request_id: str, message: dict):
+        request = ChatRequest.model_validate(message.get("request"))
+        if not openai_breaker.allows_call():
+            raise CircuitOpenError(openai_breaker.name, openai_breaker.retry_after())
+        # stored history arrives with previews of its large values
+        async with get_sessionmaker()() as db_session:
+            request.messages = await chat_service.expand_chat_messages(
+                db_session, request.messages
+            )
+        budget = StreamBudget()
+        prefix = '{"id":' + dumps(request_id) + ',"type":"chat","frame":'
+        async for frame in guard_stream(self, stream_chat(request, budget), budget):
+            # frames are already encoded JSON objects followed by a blank line
+            await self.send_encoded(prefix + frame.rstrip() + "}")
+        await self.send(request_id, "done")
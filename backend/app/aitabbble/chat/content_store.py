@@ -0,0 +1,170 @@
+"""Compressed storage for large message content.
+
+String values inside tool call content parts (tool results, search results
+echoed in tool args) that exceed `message_blob_threshold` bytes are moved to
+the `content_blobs` table, compressed and deduplicated by their SHA-256 hash.
+The part keeps a short preview in place of the value and lists the moved
+values under `_refs`, so message lists stay small and the full values can be
+fetched on demand. Text parts are kept whole, as they are always displayed.
+
+Stored messages are shown with their previews and sent back as chat history
+as they are; `expand_chat_part` puts the full values back for the model.
+"""
+
+import copy
+import hashlib
+import json
+import zlib
+from typing import Any, Iterable
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.aitabbble.config import settings
+from app.aitabbble.models import ContentBlob
+from app.aitabbble.schema import ChatMessageContent
+
+REFS_KEY = "_refs"
+
+
+def _externalize_value(value: Any, path: list, refs: list, blobs: dict) -> Any:
+    if isinstance(value, dict):
+        return {
+            key: _externalize_value(item, path + [key], refs, blobs)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [
+            _externalize_value(item, path + [index], refs, blobs)
+            for index, item in enumerate(value)
+        ]
+    if isinstance(value, str):
+        raw = value.encode()
+        if len(raw) > settings.message_blob_threshold:
+            content_hash = hashlib.sha256(raw).hexdigest()
+            blobs[content_hash] = raw
+            refs.append({"path": path, "hash": content_hash, "size": len(raw)})
+            return value[: settings.message_preview_chars] + "…"
+    return value
+
+
+def externalize_content(content: list[dict]) -> tuple[list[dict], dict[str, bytes]]:
+    """Split large values out of message content parts.
+
+    Returns the content with previews and `_refs` in place of large values,
+    and the raw values keyed by hash.
+    """
+    blobs = {}
+    stubbed = []
+    for part in content:
+        if part.get("type") == "text":
+            stubbed.append(part)
+            continue
+        refs = []
+        part = {
+            key: _externalize_value(value, [key], refs, blobs)
+            for key, value in part.items()
+            if key != REFS_KEY
+        }
+        if refs:
+            part[REFS_KEY] = refs
+        stubbed.append(part)
+    return stubbed, blobs
+
+
+async def save_blobs(db_session: AsyncSession, blobs: dict[str, bytes]):
+    """Store compressed blobs, skipping the ones that are already stored.
+
+    Uses `INSERT ... ON CONFLICT DO NOTHING`, so concurrent messages carrying
+    the same value do not race on the hash key.
+    """
+    if not blobs:
+        return
+    if db_session.get_bind().dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    await db_session.execute(
+        insert(ContentBlob)
+        .values(
+            [
+                {
+                    "hash": content_hash,
+                    "encoding": "zlib",
+                    "data": zlib.compress(raw),
+                    "size": len(raw),
+                }
+                for content_hash, raw in blobs.items()
+            ]
+        )
+        .on_conflict_do_nothing(index_elements=[ContentBlob.hash])
+    )
+
+
+def _decode(blob: ContentBlob) -> str:
+    return zlib.decompress(blob.data).decode()
+
+
+async def load_blobs(
+    db_session: AsyncSession, hashes: Iterable[str]
+) -> dict[str, str]:
+    """Fetch and decompress blobs by hash in a single query."""
+    hashes = list(set(hashes))
+    if not hashes:
+        return {}
+    db_blobs = await db_session.execute(
+        select(ContentBlob).where(ContentBlob.hash.in_(hashes))
+    )
+    return {blob.hash: _decode(blob) for blob in db_blobs.scalars().all()}
+
+
+def content_refs(content: list[dict] | None) -> list[str]:
+    """Hashes referenced by the parts of a message content."""
+    return [
+        ref["hash"]
+        for part in content or []
+        for ref in part.get(REFS_KEY, [])
+    ]
+
+
+def expand_content(content: list[dict] | None, values: dict[str, str]) -> list[dict] | None:
+    """Put the full values back in place of their previews."""
+    if not content:
+        return content
+    expanded = []
+    for part in content:
+        refs = part.get(REFS_KEY)
+        if not refs:
+            expanded.append(part)
+            continue
+        part = copy.deepcopy(
+            {key: value for key, value in part.items() if key != REFS_KEY}
+        )
+        missing = []
+        for ref in refs:
+            if ref["hash"] not in values:
+                missing.append(ref)
+                continue
+            *parents, last = ref["path"]
+            target = part
+            for key in parents:
+                target = target[key]
+            target[last] = values[ref["hash"]]
+        if missing:
+            part[REFS_KEY] = missing
+        expanded.append(part)
+    return expanded
+
+
+def expand_chat_part(
+    part: ChatMessageContent, values: dict[str, str]
+) -> ChatMessageContent:
+    """Put the full values back into a chat history part sent with previews."""
+    data = part.model_dump(by_alias=True)
+    if isinstance(data.get("args"), str) and any(
+        len(ref.path) > 1 and ref.path[0] == "args" for ref in part.refs
+    ):
+        # args are kept as a JSON string, the refs point inside the object
+        data["args"] = json.loads(data["args"])
+    (data,) = expand_content([data], values)
+    return type(part).model_validate(data)
@@ -1,17 +1,29 @@
+from typing import AsyncIterator
+
 from fastapi import HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import func, select, true
 
+from app.aitabbble.chat.content_store import (
+    content_refs,
+    expand_chat_part,
+    expand_content,
+    externalize_content,
+    load_blobs,
+    save_blobs,
+)
 from app.aitabbble.schema import (
+    ChatMessage,
+    MessageContentResponse,
     MessageCreateRequest,
     MessageCreateUpdateResponse,
-    MessageListResponse,
-    MessageResponse,
     ThreadUpdateRequest,
     ThreadListResponse,
     ThreadCreateRequest,
     ThreadCreateUpdateResponse,
     ThreadResponse,
+    ThreadSummaryListResponse,
+    ThreadSummaryResponse,
 )
 from app.aitabbble.models import Thread, Message
 
@@ -96,6 +108,73 @@ async def list_threads(db_session: AsyncSession) -> ThreadListResponse:
     )
 
 
+def _message_preview(raw_content: list[dict] | None, length: int = 100) -> str | None:
+    """First text of a message, shortened for the thread list."""
+    for part in raw_content or []:
+        if part.get("type") == "text" and part.get("text"):
+            text = part["text"].strip()
+            return text if len(text) <= length else text[:length] + "…"
+    return None
+
+
+async def list_thread_summaries(
+    db_session: AsyncSession, include_archived: bool = False
+) -> ThreadSummaryListResponse:
+    """List threads with their message count, last activity and a preview.
+
+    Everything is computed in a single query: the latest message and the
+    message count of each listed thread come from lateral subqueries, both
+    served by `ix_messages_thread_created_at`, so the cost grows with the
+    threads listed rather than with all stored messages.
+    """
+    message_counts = (
+        select(func.count().label("message_count"))
+        .where(Message.ui_thread_id == Thread.ui_thread_id)
+        .lateral("message_counts")
+    )
+    latest_message = (
+        select(Message.created_at, Message.raw_content)
+        .where(Message.ui_thread_id == Thread.ui_thread_id)
+        .order_by(Message.created_at.desc(), Message.id.desc())
+        .limit(1)
+        .lateral("latest_message")
+    )
+    last_activity = func.coalesce(latest_message.c.created_at, Thread.updated_at)
+    query = (
+        select(
+            Thread,
+            message_counts.c.message_count,
+            latest_message.c.created_at,
+            latest_message.c.raw_content,
+        )
+        .select_from(Thread)
+        .outerjoin(latest_message, true())
+        .outerjoin(message_counts, true())
+        .order_by(last_activity.desc())
+    )
+    if not include_archived:
+        query = query.where(Thread.archived.is_not(True))
+    db_threads = await db_session.execute(query)
+    return ThreadSummaryListResponse(
+        threads=[
+            ThreadSummaryResponse(
+                id=thread.ui_thread_id,
+                ui_thread_id=thread.ui_thread_id,
+                title=thread.title,
+                archived=bool(thread.archived),
+                message_count=message_count or 0,
+                last_message_at=last_message_at.isoformat()
+                if last_message_at
+                else None,
+                preview=_message_preview(raw_content),
+                created_at=thread.created_at.isoformat(),
+                updated_at=thread.updated_at.isoformat(),
+            )
+            for thread, message_count, last_message_at, raw_content in db_threads
+        ]
+    )
+
+
 async def delete_thread(db_session: AsyncSession, ui_thread_id: str):
     pass
 
@@ -103,12 +182,18 @@ async def delete_thread(db_session: AsyncSession, ui_thread_id: str):
 async def create_message(
     db_session: AsyncSession, message: MessageCreateRequest
 ) -> MessageCreateUpdateResponse:
-    """Create a new message."""
+    """Create a new message.
+
+    Large values in the content are stored compressed in the blob table and
+    replaced by previews, see `content_store`.
+    """
+    content, blobs = externalize_content(message.content)
+    await save_blobs(db_session, blobs)
     new_message = Message(
         ui_message_id=message.ui_message_id,
         ui_thread_id=message.thread_id,
         role=message.role,
-        raw_content=message.content,
+        raw_content=content,
     )
     db_session.add(new_message)
     await db_session.commit()
@@ -119,23 +204,75 @@ async def create_message(
     )
 
 
-async def list_messages(
-    db_session: AsyncSession, thread_id: str
-) -> MessageListResponse:
-    """List all messages for a thread."""
-    db_messages = await db_session.execute(
-        select(Message).where(Message.ui_thread_id == thread_id)
+async def stream_messages(
+    db_session: AsyncSession, thread_id: str, expand: bool = False
+) -> AsyncIterator[dict]:
+    """Stream all messages for a thread, one row at a time.
+
+    Rows are yielded as plain dicts in the `MessageResponse` shape, so large
+    threads can be encoded straight to the response without building the
+    whole list of pydantic models first. Large content values are returned as
+    previews unless `expand` is set, in which case they are loaded with one
+    query per batch of rows.
+    """
+    db_messages = await db_session.stream_scalars(
+        select(Message)
+        .where(Message.ui_thread_id == thread_id)
+        .execution_options(yield_per=100)
     )
-    db_messages = db_messages.scalars().all()
-    return MessageListResponse(
-        messages=[
-            MessageResponse(
-                id=message.ui_message_id,
-                thread_id=message.ui_thread_id,
-                role=message.role,
-                content=message.raw_content,
-                created_at=message.created_at.isoformat(),
+    async for batch in db_messages.partitions():
+        values = {}
+        if expand:
+            values = await load_blobs(
+                db_session,
+                (ref for message in batch for ref in content_refs(message.raw_content)),
             )
-            for message in db_messages
-        ]
-    )
+        for message in batch:
+            content = message.raw_content
+            if expand:
+                content = expand_content(content, values)
+            yield {
+                "id": message.ui_message_id,
+                "thread_id": message.ui_thread_id,
+                "role": message.role,
+                "content": content,
+                "created_at": message.created_at.isoformat(),
+                "updated_at": None,
+            }
+
+
+async def get_message_content(
+    db_session: AsyncSession, content_hash: str
+) -> MessageContentResponse:
+    """Get a full content value stored in the blob table."""
+    values = await load_blobs(db_session, [content_hash])
+    if content_hash not in values:
+        raise HTTPException(status_code=404, detail="Content not found")
+    return MessageContentResponse(hash=content_hash, content=values[content_hash])
+
+
+async def expand_chat_messages(
+    db_session: AsyncSession, messages: list[ChatMessage]
+) -> list[ChatMessage]:
+    """Put the full values back into chat history loaded with previews.
+
+    The values of all messages are loaded in one query. Without any `_refs`
+    the messages are returned as they are, without touching the database.
+    """
+    hashes = [
+        ref.hash for message in messages for part in message.content for ref in part.refs
+    ]
+    if not hashes:
+        return messages
+    values = await load_blobs(db_session, hashes)
+    return [
+        message.model_copy(
+            update={
+                "content": [
+                    expand_chat_part(part, values) if part.refs else part
+                    for part in message.content
+                ]
+            }
+        )
+        for message in messages
+    ]
@@ -0,0 +1,159 @@
+"""Guards for long-running chat streams."""
+
+import asyncio
+import time
+from typing import AsyncIterator, Protocol
+
+from app.aitabbble.config import logger, settings
+from app.aitabbble.limits import LimitTimeoutError
+from app.aitabbble.resilience import CircuitOpenError
+from app.aitabbble.serialization import text_frame
+
+
+class Disconnectable(Protocol):
+    """A client connection, such as a starlette `Request`, that can tell when it is gone."""
+
+    async def is_disconnected(self) -> bool: ...
+
+
+class StreamBudgetExceeded(Exception):
+    """Raised when a chat stream runs past its wall-clock or token ceiling."""
+
+
+class StreamBudget:
+    """Wall-clock and token ceilings shared by every round of a chat stream.
+
+    Each round of the tool loop can additionally set its own deadline with
+    `start_round`; the remaining time is the tighter of the two.
+    """
+
+    def __init__(
+        self,
+        max_seconds: float = settings.chat_stream_timeout_seconds,
+        max_tokens: int = settings.chat_stream_max_tokens,
+    ):
+        self.max_seconds = max_seconds
+        self.max_tokens = max_tokens
+        self.started_at = time.monotonic()
+        self.tokens = 0
+        self.round_timeout = None
+        self.round_started_at = self.started_at
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def start_round(self, timeout: float | None = None):
+        self.round_started_at = time.monotonic()
+        self.round_timeout = timeout
+
+    def round_elapsed(self) -> float:
+        return time.monotonic() - self.round_started_at
+
+    def remaining_seconds(self) -> float:
+        remaining = self.max_seconds - self.elapsed()
+        if self.round_timeout is not None:
+            remaining = min(remaining, self.round_timeout - self.round_elapsed())
+        return max(0.0, remaining)
+
+    def remaining_tokens(self) -> int:
+        return max(0, self.max_tokens - self.tokens)
+
+    def add_tokens(self, count: int = 1):
+        """Account for streamed tokens and raise once the ceiling is reached."""
+        self.tokens += count
+        if self.tokens >= self.max_tokens:
+            raise StreamBudgetExceeded(
+                f"token limit of {self.max_tokens} reached"
+            )
+
+    def timeout_reason(self) -> str:
+        if self.elapsed() >= self.max_seconds:
+            return f"time limit of {self.max_seconds:.0f} seconds reached"
+        return f"round time limit of {self.round_timeout:.0f} seconds reached"
+
+    def check(self):
+        if self.remaining_seconds() <= 0:
+            raise StreamBudgetExceeded(self.timeout_reason())
+
+
+def stopped_frame(reason: str) -> str:
+    """Text frame telling the user why the response stopped early."""
+    return text_frame(f"\n\n_Response stopped: {reason}._")
+
+
+async def _wait_for_disconnect(request: Disconnectable):
+    while not await request.is_disconnected():
+        await asyncio.sleep(settings.chat_disconnect_poll_interval)
+
+
+async def guard_stream(
+    request: Disconnectable, stream: AsyncIterator[str], budget: StreamBudget
+) -> AsyncIterator[str]:
+    """Relay `stream` frames until it ends, the client leaves or the budget runs out.
+
+    Running out of budget, or of room under the shared OpenAI limits, and
+    calls rejected by the circuit breaker end the stream with a frame telling
+    the user why. On disconnect or timeout the pending step of `stream` is cancelled, which
+    unwinds the upstream OpenAI stream and any running tool immediately instead
+    of letting them run to completion for nobody.
+    """
+    disconnect = asyncio.create_task(_wait_for_disconnect(request))
+    next_frame = None
+    try:
+        while True:
+            next_frame = asyncio.ensure_future(anext(stream))
+            done, _ = await asyncio.wait(
+                {next_frame, disconnect},
+                timeout=budget.remaining_seconds(),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if next_frame not in done:
+                if disconnect in done:
+                    logger.warning(
+                        f"Chat stream aborted: client disconnected after "
+                        f"{budget.elapsed():.1f}s, {budget.tokens} tokens"
+                    )
+                    return
+                reason = budget.timeout_reason()
+                logger.warning(
+                    f"Chat stream aborted: {reason} after {budget.tokens} tokens"
+                )
+                yield stopped_frame(reason)
+                return
+            try:
+                frame = next_frame.result()
+            except StopAsyncIteration:
+                return
+            except StreamBudgetExceeded as e:
+                logger.warning(
+                    f"Chat stream aborted: {e} after {budget.elapsed():.1f}s"
+                )
+                yield stopped_frame(str(e))
+                return
+            except LimitTimeoutError as e:
+                # the response has already started, so report it in the stream
+                logger.warning(f"Chat stream aborted: {e}")
+                yield stopped_frame("the AI service is busy, please retry later")
+                return
+            except CircuitOpenError as e:
+                logger.warning(f"Chat stream aborted: {e}")
+                yield stopped_frame(
+                    "the AI service is temporarily unavailable, please retry later"
+                )
+                return
+            yield frame
+    except asyncio.CancelledError:
+        logger.warning(
+            f"Chat stream aborted: response cancelled after "
+            f"{budget.elapsed():.1f}s, {budget.tokens} tokens"
+        )
+        raise
+    finally:
+        disconnect.cancel()
+        if next_frame is not None and not next_frame.done():
+            next_frame.cancel()
+            try:
+                await next_frame
+            except (asyncio.CancelledError, Exception):
+                pass
+        await stream.aclose()
@@ -14,8 +14,50 @@ class Settings(BaseSettings):
     openai_model: str = Field("gpt-4.1-mini")
     openai_search_model: str = Field("gpt-4o-mini-search-preview")
     openai_max_retries: int = Field(5, gt=0)
+    openai_retry_budget_seconds: float = Field(30.0, gt=0)
+    openai_retry_max_wait: float = Field(10.0, gt=0)
+    openai_circuit_failure_rate: float = Field(0.5, gt=0, le=1)
+    openai_circuit_minimum_calls: int = Field(10, gt=0)
+    openai_circuit_window_size: int = Field(50, gt=0)
+    openai_circuit_recovery_timeout: float = Field(30.0, gt=0)
+    openai_circuit_half_open_max_calls: int = Field(1, gt=0)
     openai_temperature: float = Field(0.1, gt=0)
     openai_max_tokens: int = Field(1000, gt=0)
+    openai_batch_poll_interval: float = Field(30.0, gt=0)
+    openai_batch_max_requests: int = Field(50_000, gt=0)
+    openai_batch_max_bytes: int = Field(200 * 1024 * 1024, gt=0)
+    chat_stream_timeout_seconds: float = Field(120.0, gt=0)
+    chat_stream_max_tokens: int = Field(8000, gt=0)
+    chat_max_tool_rounds: int = Field(5, ge=0)
+    chat_round_timeout_seconds: float = Field(60.0, gt=0)
+    sheet_query_max_rows: int = Field(200, gt=0)
+    sheet_query_timeout_seconds: float = Field(2.0, gt=0)
+    chat_disconnect_poll_interval: float = Field(0.5, gt=0)
+    openai_requests_per_minute: int = Field(500, gt=0)
+    openai_max_concurrency: int = Field(32, gt=0)
+    openai_limit_wait_timeout: float = Field(10.0, gt=0)
+    shared_limits: bool | None = Field(None)
+    shared_state_path: str = Field("/tmp/aitabbble-limits.sqlite3")
+    web_host: str = Field("0.0.0.0")
+    web_port: int = Field(8000, gt=0)
+    web_workers: int = Field(1, gt=0)
+    web_reload: bool | None = Field(None)
+    web_backlog: int = Field(2048, gt=0)
+    web_timeout_keep_alive: int = Field(5, gt=0)
+    web_limit_concurrency: int | None = Field(None)
+    message_blob_threshold: int = Field(4096, gt=0)
+    message_preview_chars: int = Field(500, ge=0)
+    speculative_rows_ahead: int = Field(5, ge=0)
+    speculative_concurrency: int = Field(2, gt=0)
+    speculative_max_entries: int = Field(500, gt=0)
+    speculative_ttl_seconds: float = Field(300.0, gt=0)
+    channel_send_queue_size: int = Field(64, gt=0)
+    channel_max_inflight: int = Field(16, gt=0)
+    channel_recalculate_concurrency: int = Field(4, gt=0)
+    profiling_sample_rate: float = Field(0.0, ge=0, le=1)
+    profiling_dir: str = Field("/tmp/aitabbble-profiles")
+    profiling_max_profiles: int = Field(500, gt=0)
+    admin_token: str | None = Field(None)
     log_level: str = Field("INFO")
     sentry_dsn: str | None = Field(None)
 
@@ -3,21 +3,47 @@
 from sqlalchemy.ext.asyncio import (
     create_async_engine,
     async_sessionmaker,
+    AsyncEngine,
     AsyncSession,
 )
 
 from app.aitabbble.config import settings
 from app.aitabbble.models import Base
+from app.aitabbble.profiling import instrument_engine
 
-# Database setup
-engine = create_async_engine(settings.database_url)
-AsyncSessionLocal = async_sessionmaker(
-    engine, class_=AsyncSession, expire_on_commit=False
-)
+# Database setup. The engine owns a connection pool, so every worker process
+# creates its own on first use instead of inheriting one. Creating it lazily
+# also defers loading the database driver until a session is needed.
+engine: AsyncEngine | None = None
+AsyncSessionLocal: async_sessionmaker[AsyncSession] | None = None
+
+
+def get_engine() -> AsyncEngine:
+    global engine, AsyncSessionLocal
+    if engine is None:
+        engine = create_async_engine(settings.database_url)
+        instrument_engine(engine.sync_engine)
+        AsyncSessionLocal = async_sessionmaker(
+            engine, class_=AsyncSession, expire_on_commit=False
+        )
+    return engine
+
+
+def get_sessionmaker() -> async_sessionmaker[AsyncSession]:
+    get_engine()
+    return AsyncSessionLocal
+
+
+async def dispose_engine():
+    global engine, AsyncSessionLocal
+    if engine is not None:
+        await engine.dispose()
+    engine = None
+    AsyncSessionLocal = None
 
 
 async def get_db_session():
-    async with AsyncSessionLocal() as session:
+    async with get_sessionmaker()() as session:
         try:
             yield session
         finally:
@@ -26,5 +52,5 @@ async def get_db_session():
 
 # Create tables if the environment is local
 async def create_tables():
-    async with engine.begin() as conn:
+    async with get_engine().begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
@@ -0,0 +1,265 @@
+"""Rate and concurrency limits shared by every worker process.
+
+Counters live in a small SQLite file on local disk, so limits hold across
+uvicorn workers on the same box without an external service. Every process
+opens its own connection lazily, which keeps the store safe to use after a
+fork.
+
+Each limited call costs three short SQLite transactions, about a millisecond
+in total, serialized per process. The limits are therefore only applied when
+they are needed to coordinate several workers, see `shared_limits_enabled`.
+"""
+
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+from app.aitabbble.config import settings
+
+
+class LimitTimeoutError(Exception):
+    """Raised when a shared limit has no room within the wait timeout."""
+
+    def __init__(self, name: str, retry_after: float):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__(
+            f"Limit '{name}' is exhausted, retry in {retry_after:.1f} seconds"
+        )
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SharedCounterStore:
+    """File-backed counters and slots with cross-process transactions."""
+
+    def __init__(self, path: str, stale_slot_seconds: float = 600.0):
+        self.path = path
+        self.stale_slot_seconds = stale_slot_seconds
+        self._lock = threading.Lock()
+        self._conn = None
+        self._conn_pid = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # never reuse a connection inherited from a parent process
+        if self._conn is None or self._conn_pid != os.getpid():
+            conn = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None, check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_windows ("
+                "name TEXT NOT NULL, window_id INTEGER NOT NULL, count INTEGER NOT NULL, "
+                "PRIMARY KEY (name, window_id))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS slots ("
+                "name TEXT NOT NULL, holder TEXT PRIMARY KEY, pid INTEGER NOT NULL, "
+                "acquired_at REAL NOT NULL)"
+            )
+            self._conn = conn
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    def _transaction(self, fn):
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(conn)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            return result
+
+    def reset(self):
+        """Drop all counters, e.g. when the launcher starts a fresh set of workers."""
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(self.path + suffix)
+            except FileNotFoundError:
+                pass
+        self._conn = None
+
+    def try_increment(self, name: str, window: int, limit: int) -> bool:
+        """Count one event in `window` unless `limit` events are already counted."""
+
+        def increment(conn):
+            conn.execute(
+                "DELETE FROM rate_windows WHERE name = ? AND window_id < ?", (name, window)
+            )
+            row = conn.execute(
+                "SELECT count FROM rate_windows WHERE name = ? AND window_id = ?",
+                (name, window),
+            ).fetchone()
+            count = row[0] if row else 0
+            if count >= limit:
+                return False
+            conn.execute(
+                "INSERT INTO rate_windows (name, window_id, count) VALUES (?, ?, 1) "
+                "ON CONFLICT (name, window_id) DO UPDATE SET count = count + 1",
+                (name, window),
+            )
+            return True
+
+        return self._transaction(increment)
+
+    def try_acquire_slot(self, name: str, limit: int, holder: str) -> bool:
+        """Take one of `limit` slots for `holder`, reclaiming slots of dead workers."""
+
+        def acquire(conn):
+            for (pid,) in conn.execute(
+                "SELECT DISTINCT pid FROM slots WHERE name = ?", (name,)
+            ).fetchall():
+                if not _pid_alive(pid):
+                    conn.execute("DELETE FROM slots WHERE pid = ?", (pid,))
+            conn.execute(
+                "DELETE FROM slots WHERE name = ? AND acquired_at < ?",
+                (name, time.time() - self.stale_slot_seconds),
+            )
+            (taken,) = conn.execute(
+                "SELECT COUNT(*) FROM slots WHERE name = ?", (name,)
+            ).fetchone()
+            if taken >= limit:
+                return False
+            conn.execute(
+                "INSERT INTO slots (name, holder, pid, acquired_at) VALUES (?, ?, ?, ?)",
+                (name, holder, os.getpid(), time.time()),
+            )
+            return True
+
+        return self._transaction(acquire)
+
+    def release_slot(self, holder: str):
+        self._transaction(
+            lambda conn: conn.execute("DELETE FROM slots WHERE holder = ?", (holder,))
+        )
+
+
+class SharedRateLimiter:
+    """Fixed-window limit of `limit` events per `period` seconds across workers."""
+
+    def __init__(
+        self,
+        store: SharedCounterStore,
+        name: str,
+        limit: int,
+        period: float = 60.0,
+        timeout: float = settings.openai_limit_wait_timeout,
+    ):
+        self.store = store
+        self.name = name
+        self.limit = limit
+        self.period = period
+        self.timeout = timeout
+
+    async def acquire(self, timeout: float | None = None):
+        """Wait until the current window has room and count one event.
+
+        Raises `LimitTimeoutError` instead of waiting past `timeout` seconds,
+        `self.timeout` by default.
+        """
+        deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        while True:
+            now = time.time()
+            window = int(now // self.period)
+            if await asyncio.to_thread(
+                self.store.try_increment, self.name, window, self.limit
+            ):
+                return
+            wait = (window + 1) * self.period - now
+            if time.monotonic() + wait > deadline:
+                raise LimitTimeoutError(self.name, wait)
+            await asyncio.sleep(wait)
+
+
+class SharedConcurrencyLimiter:
+    """Cap on concurrently running operations across workers."""
+
+    def __init__(
+        self,
+        store: SharedCounterStore,
+        name: str,
+        limit: int,
+        poll_interval: float = 0.05,
+        timeout: float = settings.openai_limit_wait_timeout,
+    ):
+        self.store = store
+        self.name = name
+        self.limit = limit
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+    @asynccontextmanager
+    async def slot(self, timeout: float | None = None):
+        """Hold one slot, raising `LimitTimeoutError` if none frees up within `timeout`.
+
+        `timeout` defaults to `self.timeout`.
+        """
+        holder = f"{os.getpid()}:{uuid.uuid4()}"
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while not await asyncio.to_thread(
+            self.store.try_acquire_slot, self.name, self.limit, holder
+        ):
+            if time.monotonic() + self.poll_interval > deadline:
+                raise LimitTimeoutError(self.name, max(timeout, self.poll_interval))
+            await asyncio.sleep(self.poll_interval)
+        try:
+            yield
+        finally:
+            await asyncio.to_thread(self.store.release_slot, holder)
+
+
+shared_store = SharedCounterStore(settings.shared_state_path)
+openai_rate_limiter = SharedRateLimiter(
+    shared_store, "openai_requests", settings.openai_requests_per_minute
+)
+openai_concurrency = SharedConcurrencyLimiter(
+    shared_store, "openai_concurrency", settings.openai_max_concurrency
+)
+
+
+def shared_limits_enabled() -> bool:
+    """Whether OpenAI calls go through the shared limits.
+
+    Follows `shared_limits` when set, and is otherwise on only for deployments
+    running several workers.
+    """
+    if settings.shared_limits is None:
+        return settings.web_workers > 1
+    return settings.shared_limits
+
+
+@asynccontextmanager
+async def openai_call_slot(timeout: float | None = None):
+    """Reserve room for one OpenAI call under the shared rate and concurrency caps.
+
+    Waits up to `timeout` seconds for each cap, `openai_limit_wait_timeout`
+    by default; pass 0 to fail right away when there is no room.
+
+    Enter it before the circuit breaker, so a call waiting for room does not
+    hold the breaker's half-open probe. Hold it around the request only:
+    streamed responses are read after leaving it, so a long chat stream does
+    not keep other calls waiting. Does nothing while the shared limits are
+    disabled.
+    """
+    if not shared_limits_enabled():
+        yield
+        return
+    await openai_rate_limiter.acquire(timeout)
+    async with openai_concurrency.slot(timeout):
+        yield
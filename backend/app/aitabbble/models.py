@@ -11,6 +11,8 @@ from sqlalchemy import (
     Boolean,
     Integer,
     ForeignKey,
+    Index,
+    LargeBinary,
 )
 
 
@@ -31,12 +33,12 @@ class Thread(Base):
     title = Column(String(255))
     archived = Column(Boolean, default=False)
     created_at = Column(
-        DateTime(timezone=True), default=datetime.datetime.now(datetime.timezone.utc)
+        DateTime(timezone=True), default=lambda: datetime.datetime.now(datetime.timezone.utc)
     )
     updated_at = Column(
         DateTime(timezone=True),
-        default=datetime.datetime.now(datetime.timezone.utc),
-        onupdate=datetime.datetime.now(datetime.timezone.utc),
+        default=lambda: datetime.datetime.now(datetime.timezone.utc),
+        onupdate=lambda: datetime.datetime.now(datetime.timezone.utc),
     )
     messages = relationship("Message", back_populates="thread")
 
@@ -55,5 +57,25 @@ class Message(Base):
     role = Column(String(20), nullable=False)
     raw_content = Column(JSON)
     created_at = Column(
-        DateTime(timezone=True), default=datetime.datetime.now(datetime.timezone.utc)
+        DateTime(timezone=True), default=lambda: datetime.datetime.now(datetime.timezone.utc)
+    )
+
+    __table_args__ = (
+        # serves per-thread message lists and thread summaries
+        Index("ix_messages_thread_created_at", "ui_thread_id", "created_at"),
+    )
+
+
+class ContentBlob(Base):
+    """Large message content value, stored compressed and deduplicated by hash."""
+
+    __tablename__ = "content_blobs"
+
+    hash = Column(String(64), primary_key=True, comment="SHA-256 of the raw value")
+    encoding = Column(String(20), nullable=False, default="zlib")
+    data = Column(LargeBinary, nullable=False)
+    size = Column(Integer, nullable=False, comment="Uncompressed size in bytes")
+    created_at = Column(
+        DateTime(timezone=True),
+        default=lambda: datetime.datetime.now(datetime.timezone.utc),
     )
@@ -1,56 +1,73 @@
+import asyncio
 import json
 import random
-from typing import List
+from contextlib import aclosing
+from typing import TYPE_CHECKING, List
 
-from openai import AsyncOpenAI, RateLimitError, APITimeoutError, APIConnectionError
 from tenacity import (
     retry,
     stop_after_attempt,
-    wait_exponential,
-    retry_if_exception_type,
+    stop_after_delay,
+    wait_random_exponential,
+    retry_if_exception,
     before_sleep_log,
 )
 
 
+from app.aitabbble.chat.streaming import StreamBudget
 from app.aitabbble.config import settings
+from app.aitabbble.limits import openai_call_slot
+from app.aitabbble.profiling import (
+    PROMPT_BUILD,
+    TOOL_EXECUTION,
+    UPSTREAM_WAIT,
+    profile_phase,
+    profiled_iter,
+)
+from app.aitabbble.resilience import is_upstream_error, openai_breaker, wait_retry_after
+from app.aitabbble.serialization import text_frame
 from app.aitabbble.schema import CalculationRequest, ChatRequest, ChatMessage
-from app.aitabbble.tools import AiTool, RandomTool, WebSearchTool
+from app.aitabbble.sheet import SheetDatabase
+from app.aitabbble.tools import AiTool, RandomTool, SheetQueryTool, WebSearchTool
 
 from app.aitabbble.config import logger
 
-# Initialize OpenAI client
-openai_client = AsyncOpenAI(api_key=settings.openai_api_key).with_options(
-    max_retries=settings.openai_max_retries,
-)
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
 
+# OpenAI client, created on first use by every worker process.
+openai_client: "AsyncOpenAI | None" = None
 
-@retry(
-    stop=stop_after_attempt(5),
-    wait=wait_exponential(multiplier=1, min=4, max=10),
-    retry=retry_if_exception_type(
-        (RateLimitError, APITimeoutError, APIConnectionError)
-    ),
-    before_sleep=before_sleep_log(logger, logger.level),
-    reraise=True,
-)
-async def calculate_with_openai(request: CalculationRequest) -> str:
-    """Calculate a cell value using OpenAI based on the provided formula and spreadsheet context.
 
-    This function includes automatic retry logic with exponential backoff for handling
-    OpenAI rate limits, timeouts, and connection errors. It will retry up to 5 times
-    with increasing delays (4-10 seconds).
+def get_openai_client() -> "AsyncOpenAI":
+    """Return the OpenAI client of the current worker process, creating it on first use.
 
-    Args:
-        request: The calculation request containing formula, target cell, columns, and data
+    The `openai` package is imported here rather than at module level to keep
+    it off the startup path. Retries are handled by tenacity below so that
+    every call has a single retry budget instead of stacking client retries.
+    """
+    global openai_client
+    if openai_client is None:
+        from openai import AsyncOpenAI
 
-    Returns:
-        The calculated value as a string from OpenAI
+        openai_client = AsyncOpenAI(api_key=settings.openai_api_key).with_options(
+            max_retries=0,
+        )
+    return openai_client
 
-    Raises:
-        RateLimitError: If rate limit exceeded after all retries
-        APITimeoutError: If API timeout after all retries
-        APIConnectionError: If connection error after all retries
-        Exception: If other OpenAI API call failures occur
+
+async def close_openai_client():
+    global openai_client
+    if openai_client is not None:
+        await openai_client.close()
+    openai_client = None
+
+
+def calculation_completion_params(request: CalculationRequest) -> dict:
+    """Build the chat completion parameters for a cell calculation.
+
+    Shared by the synchronous endpoint and the batch path so both send the
+    same prompt.
     """
     # Construct the prompt for OpenAI
     system_prompt = (
@@ -74,20 +91,38 @@ async def calculate_with_openai(request: CalculationRequest) -> str:
         INSTRUCTION: "{request.formula}"
         """
 
+    return {
+        "model": settings.openai_model,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ],
+        "temperature": settings.openai_temperature,  # Low temperature for consistent calculations
+        "max_tokens": settings.openai_max_tokens,
+    }
+
+
+async def request_calculation(
+    request: CalculationRequest, limit_timeout: float | None = None
+) -> str:
+    """Make a single calculation call to OpenAI, without retries.
+
+    Goes through the shared limits, waiting up to `limit_timeout` seconds for
+    room (see `openai_call_slot`), and the shared circuit breaker.
+    """
     logger.info(
         f"Processing calculation request for cell {request.target_cell.row_id}:{request.target_cell.column_id}"
     )
 
+    with profile_phase(PROMPT_BUILD):
+        completion_params = calculation_completion_params(request)
+
     # Make asynchronous call to OpenAI
-    response = await openai_client.chat.completions.create(
-        model=settings.openai_model,
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt},
-        ],
-        temperature=settings.openai_temperature,  # Low temperature for consistent calculations
-        max_tokens=settings.openai_max_tokens,
-    )
+    with profile_phase(UPSTREAM_WAIT):
+        async with openai_call_slot(limit_timeout), openai_breaker:
+            response = await get_openai_client().chat.completions.create(
+                **completion_params,
+            )
 
     # Extract the calculated value from the response
     calculated_value = response.choices[0].message.content.strip()
@@ -96,17 +131,58 @@ async def calculate_with_openai(request: CalculationRequest) -> str:
     return calculated_value
 
 
+@retry(
+    stop=(
+        stop_after_attempt(settings.openai_max_retries)
+        | stop_after_delay(settings.openai_retry_budget_seconds)
+    ),
+    wait=wait_retry_after(
+        fallback=wait_random_exponential(multiplier=0.5, max=settings.openai_retry_max_wait),
+        max_wait=settings.openai_retry_max_wait,
+    ),
+    retry=retry_if_exception(is_upstream_error),
+    before_sleep=before_sleep_log(logger, logger.level),
+    reraise=True,
+)
+async def calculate_with_openai(request: CalculationRequest) -> str:
+    """Calculate a cell value using OpenAI based on the provided formula and spreadsheet context.
+
+    This function includes automatic retry logic for handling OpenAI rate limits,
+    timeouts, connection and server errors. Waits honor the server's Retry-After
+    hint and fall back to jittered exponential backoff. Attempts are bounded by
+    `openai_max_retries` and `openai_retry_budget_seconds`. Every attempt goes
+    through the shared circuit breaker, so calls fail fast while it is open.
+
+    Args:
+        request: The calculation request containing formula, target cell, columns, and data
+
+    Returns:
+        The calculated value as a string from OpenAI
+
+    Raises:
+        RateLimitError: If rate limit exceeded after all retries
+        APITimeoutError: If API timeout after all retries
+        APIConnectionError: If connection error after all retries
+        CircuitOpenError: If the OpenAI circuit breaker is open
+        LimitTimeoutError: If the shared rate or concurrency limit has no room in time
+        Exception: If other OpenAI API call failures occur
+    """
+    return await request_calculation(request)
+
+
 async def random_number():
     """Tool to generate a random number between 1 and 100."""
     return random.randint(1, 100)
 
 
-def tool_factory(function_name, arguments=None) -> AiTool:
+def tool_factory(function_name, arguments=None, sheet: SheetDatabase = None) -> AiTool:
     match function_name.lower():
         case "generate_random_integer":
             return RandomTool()
         case "web_search":
             return WebSearchTool()
+        case "query_sheet" if sheet is not None:
+            return SheetQueryTool(sheet)
         case _:
             return None
 
@@ -146,6 +222,27 @@ TOOLS = [
     },
 ]
 
+# Only offered when the chat request carries the current sheet
+SHEET_QUERY_TOOL = {
+    "type": "function",
+    "function": {
+        "name": "query_sheet",
+        "description": f"Run a read-only SQLite SELECT query against the user's spreadsheet, stored in the table \"sheet\". Use filters, aggregates and LIMIT to fetch only the rows and values you need; at most {settings.sheet_query_max_rows} rows are returned. The result is JSON with the column names, the rows and whether the rows were truncated.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "query": {
+                    "type": "string",
+                    "description": "A single SQLite SELECT statement. Quote column names with double quotes, e.g. SELECT \"Department\", AVG(\"Salary\") FROM sheet GROUP BY 1.",
+                },
+            },
+            "required": ["query"],
+            "additionalProperties": False,
+        },
+        "strict": True,
+    },
+}
+
 
 def assistant_messages_to_openai(messages: List[ChatMessage]):
     """
@@ -191,101 +288,186 @@ def assistant_messages_to_openai(messages: List[ChatMessage]):
     return openai_messages
 
 
-async def _stream_openai_chat(chat_messages: List[dict]):
-    """Stream the chat with the OpenAI API."""
-    response = await openai_client.chat.completions.create(
-        model=settings.openai_model,
-        messages=chat_messages,
-        tools=TOOLS,
-        stream=True,
-    )
-
-    full_content = ""
-    tool_calls = []
-
-    async for chunk in response:
-        print(chunk)
-        # Handle tool calls
-        if chunk.choices[0].delta.tool_calls:
-            for tool_call in chunk.choices[0].delta.tool_calls:
-                # Initialize tool call if new
-                while len(tool_calls) <= tool_call.index:
-                    tool_calls.append(
-                        {
-                            "id": None,
-                            "type": "function",
-                            "function": {"name": "", "arguments": ""},
-                        }
-                    )
+def _accumulate_tool_calls(tool_calls: List[dict], tool_call_deltas) -> int:
+    """Merge streamed tool call deltas into `tool_calls`.
 
-                if tool_call.id:
-                    tool_calls[tool_call.index]["id"] = tool_call.id
+    Returns the number of argument deltas merged, for token accounting.
+    """
+    argument_deltas = 0
+    for tool_call in tool_call_deltas:
+        # Initialize tool call if new
+        while len(tool_calls) <= tool_call.index:
+            tool_calls.append(
+                {
+                    "id": None,
+                    "type": "function",
+                    "function": {"name": "", "arguments": ""},
+                }
+            )
+
+        if tool_call.id:
+            tool_calls[tool_call.index]["id"] = tool_call.id
+
+        if tool_call.function:
+            if tool_call.function.name:
+                tool_calls[tool_call.index]["function"]["name"] = (
+                    tool_call.function.name
+                )
+            if tool_call.function.arguments:
+                tool_calls[tool_call.index]["function"]["arguments"] += (
+                    tool_call.function.arguments
+                )
+                argument_deltas += 1
+    return argument_deltas
+
+
+async def _stream_openai_chat(
+    chat_messages: List[dict],
+    budget: StreamBudget,
+    tools: List[dict] = TOOLS,
+    sheet: SheetDatabase = None,
+):
+    """Stream the chat with the OpenAI API.
+
+    Runs an iterative agent loop: each round streams one completion and, if
+    the model asks for a tool, runs it and feeds the result into the next
+    round. At most `chat_max_tool_rounds` tools run per stream; after that the
+    model is asked to answer without tools. Every round is bounded by
+    `chat_round_timeout_seconds` on top of the stream budget.
+
+    The upstream stream and any running tool are closed as soon as this
+    generator is closed or cancelled, e.g. when the client disconnects.
+    """
+    tool_rounds = 0
+    round_number = 0
+
+    while True:
+        round_number += 1
+        budget.start_round(settings.chat_round_timeout_seconds)
+        allow_tools = tool_rounds < settings.chat_max_tool_rounds
+        budget.check()
+        tool_calls = []
+        tool_calls_finished = False
+
+        # the shared slot covers the call only, not reading the stream it opens
+        with profile_phase(UPSTREAM_WAIT):
+            async with openai_call_slot(), openai_breaker:
+                response = await get_openai_client().chat.completions.create(
+                    model=settings.openai_model,
+                    messages=chat_messages,
+                    tools=tools,
+                    tool_choice="auto" if allow_tools else "none",
+                    max_tokens=budget.remaining_tokens(),
+                    stream=True,
+                )
 
-                if tool_call.function:
-                    if tool_call.function.name:
-                        tool_calls[tool_call.index]["function"]["name"] = (
-                            tool_call.function.name
-                        )
-                    if tool_call.function.arguments:
-                        tool_calls[tool_call.index]["function"]["arguments"] += (
-                            tool_call.function.arguments
+        try:
+            async for chunk in profiled_iter(response, UPSTREAM_WAIT):
+                budget.check()
+                # Handle tool calls
+                if chunk.choices[0].delta.tool_calls:
+                    budget.add_tokens(
+                        _accumulate_tool_calls(
+                            tool_calls, chunk.choices[0].delta.tool_calls
                         )
+                    )
+
+                # Handle content
+                content = chunk.choices[0].delta.content
+                if content is not None:
+                    yield text_frame(content)
+                    budget.add_tokens()
 
-        # Handle content
-        content = chunk.choices[0].delta.content
-        if content is not None:
-            print("No tool calls, adding content")
-            full_content += content
-            yield json.dumps({"type": "text", "text": content}) + "\n\n"
-
-        if len(tool_calls) > 0 and chunk.choices[0].finish_reason == "tool_calls":
-            print(f"Tool calls, executing tools: {tool_calls}")
-            # only take a single tool call for now
-            tool_call = tool_calls[0]
-            tool = tool_factory(tool_call["function"]["name"])
-            if tool:
-                async for tool_progress in tool.run(
-                    tool_call["id"], tool_call["function"]["arguments"]
+                if (
+                    len(tool_calls) > 0
+                    and chunk.choices[0].finish_reason == "tool_calls"
+                ):
+                    tool_calls_finished = True
+                    break
+        finally:
+            await response.close()
+
+        # only take a single tool call for now
+        tool_call = tool_calls[0] if tool_calls_finished and allow_tools else None
+        tool = (
+            tool_factory(tool_call["function"]["name"], sheet=sheet)
+            if tool_call
+            else None
+        )
+        if tool is None:
+            logger.info(
+                f"Chat round {round_number} finished in {budget.round_elapsed():.2f}s"
+            )
+            return
+
+        logger.info(f"Chat round {round_number} executing tool {tool.tool_name}")
+        try:
+            async with aclosing(
+                tool.run(tool_call["id"], tool_call["function"]["arguments"])
+            ) as tool_progress_stream:
+                async for tool_progress in profiled_iter(
+                    tool_progress_stream, TOOL_EXECUTION
                 ):
                     # report the tool execution progress to the client
                     yield tool_progress
-                # update the chat messages with the tool call
-                chat_messages.append(
+                    budget.check()
+        except asyncio.CancelledError:
+            logger.info(f"Tool {tool.tool_name} cancelled")
+            raise
+        tool_rounds += 1
+
+        # update the chat messages with the tool call
+        chat_messages.append(
+            {
+                "tool_calls": [
                     {
-                        "tool_calls": [
-                            {
-                                "id": tool_call["id"],
-                                "type": "function",
-                                "function": {
-                                    "name": tool_call["function"]["name"],
-                                    "arguments": tool_call["function"]["arguments"],
-                                },
-                            }
-                        ],
-                        "role": "assistant",
-                    }
-                )
-                # update the chat messages with the tool call result
-                chat_messages.append(
-                    {
-                        "tool_call_id": tool_call["id"],
-                        "role": "tool",
-                        "content": str(tool.result),
+                        "id": tool_call["id"],
+                        "type": "function",
+                        "function": {
+                            "name": tool_call["function"]["name"],
+                            "arguments": tool_call["function"]["arguments"],
+                        },
                     }
-                )
-                # call the stream_chat recursively to handle the next tool call
-                async for ai_tool_result in _stream_openai_chat(chat_messages):
-                    yield ai_tool_result
-
-                return
-
-
-async def stream_chat(chat_request: ChatRequest):
+                ],
+                "role": "assistant",
+            }
+        )
+        # update the chat messages with the tool call result
+        chat_messages.append(
+            {
+                "tool_call_id": tool_call["id"],
+                "role": "tool",
+                "content": str(tool.result),
+            }
+        )
+        logger.info(
+            f"Chat round {round_number} finished in {budget.round_elapsed():.2f}s "
+            f"({tool_rounds}/{settings.chat_max_tool_rounds} tool rounds used)"
+        )
+
+
+async def stream_chat(chat_request: ChatRequest, budget: StreamBudget | None = None):
     """Stream the chat with the OpenAI API."""
-    chat_messages = assistant_messages_to_openai(chat_request.messages)
+    budget = budget or StreamBudget()
+    tools = TOOLS
+    sheet = None
+    with profile_phase(PROMPT_BUILD):
+        chat_messages = assistant_messages_to_openai(chat_request.messages)
+        if chat_request.sheet is not None:
+            # the model only sees the sheet schema and queries the data on demand
+            sheet = SheetDatabase(chat_request.sheet)
+            chat_messages.insert(0, {"role": "system", "content": sheet.describe()})
+            tools = TOOLS + [SHEET_QUERY_TOOL]
 
-    async for result in _stream_openai_chat(chat_messages):
-        yield result
+    try:
+        async with aclosing(
+            _stream_openai_chat(chat_messages, budget, tools=tools, sheet=sheet)
+        ) as chat_stream:
+            async for result in chat_stream:
+                yield result
+    finally:
+        if sheet is not None:
+            sheet.close()
 
 
 def parse_result_value(calculated_value: str):
@@ -0,0 +1,355 @@
+"""Opt-in per-request profiling.
+
+A sampled fraction of requests (`profiling_sample_rate`), and any request
+sending the admin token in the `X-Profile` header, is timed in named phases:
+
+    parse_validate  reading and validating the request body
+    prompt_build    building the OpenAI messages
+    upstream_wait   waiting on OpenAI, including the shared rate limits
+    tool_execution  running chat tools
+    db              database statements
+    serialize       encoding the response
+
+Phases are inclusive and may nest (a tool waiting on OpenAI counts towards
+both), so they do not have to add up to the total. Profiles are written as
+JSON files to `profiling_dir`, shared by all workers, keeping the newest
+`profiling_max_profiles`, and are listed by `/api/admin/profiles`.
+
+Instrumented code calls `profile_phase`, which does nothing when the current
+request is not being profiled.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import functools
+import hmac
+import inspect
+import os
+import random
+import re
+import secrets
+import time
+from datetime import datetime, timezone
+from typing import AsyncIterable, AsyncIterator, Callable, TypeVar
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.aitabbble.config import logger, settings
+from app.aitabbble.schema import PhaseTiming, RequestProfileResponse
+
+PARSE_VALIDATE = "parse_validate"
+PROMPT_BUILD = "prompt_build"
+UPSTREAM_WAIT = "upstream_wait"
+TOOL_EXECUTION = "tool_execution"
+DB = "db"
+SERIALIZE = "serialize"
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_ID_HEADER = b"x-profile-id"
+ADMIN_PATH_PREFIX = "/api/admin/"
+
+_PROFILE_ID = re.compile(r"^\d{20}-[0-9a-f]{8}$")
+
+T = TypeVar("T")
+
+
+def is_admin(token: str | bytes | None) -> bool:
+    """Whether `token` grants access to profiling; always false without `admin_token`."""
+    if not settings.admin_token or token is None:
+        return False
+    if isinstance(token, str):
+        token = token.encode()
+    # compared as bytes, as compare_digest rejects non-ASCII strings
+    return hmac.compare_digest(token, settings.admin_token.encode())
+
+
+class RequestProfile:
+    """Phase timings collected for one request."""
+
+    def __init__(self, method: str, path: str, trigger: str):
+        self.id = f"{time.time_ns():020d}-{secrets.token_hex(4)}"
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.status = None
+        self.started_at = datetime.now(timezone.utc)
+        self._started = time.perf_counter()
+        self.total = 0.0
+        self.phases: dict[str, list] = {}
+        # set by ProfiledRoute to split body handling from the endpoint itself
+        self.handler_started = None
+        self.endpoint_finished = None
+
+    def add(self, phase: str, seconds: float):
+        timing = self.phases.setdefault(phase, [0.0, 0])
+        timing[0] += seconds
+        timing[1] += 1
+
+    def finish(self, status: int | None):
+        self.status = status
+        self.total = time.perf_counter() - self._started
+
+    def to_response(self) -> RequestProfileResponse:
+        return RequestProfileResponse(
+            id=self.id,
+            method=self.method,
+            path=self.path,
+            status=self.status,
+            trigger=self.trigger,
+            started_at=self.started_at.isoformat(),
+            total_ms=round(self.total * 1000, 3),
+            phases={
+                phase: PhaseTiming(ms=round(seconds * 1000, 3), count=count)
+                for phase, (seconds, count) in self.phases.items()
+            },
+        )
+
+
+_current_profile: contextvars.ContextVar[RequestProfile | None] = (
+    contextvars.ContextVar("current_profile", default=None)
+)
+
+
+def current_profile() -> RequestProfile | None:
+    return _current_profile.get()
+
+
+@contextlib.contextmanager
+def unprofiled():
+    """Detach the enclosed block, and any task it starts, from the current profile.
+
+    Tasks copy the context they are created in, so background work outliving
+    the request would otherwise keep adding to a profile already saved.
+    """
+    token = _current_profile.set(None)
+    try:
+        yield
+    finally:
+        _current_profile.reset(token)
+
+
+@contextlib.contextmanager
+def profile_phase(phase: str):
+    """Time the enclosed block as `phase` of the current request profile."""
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(phase, time.perf_counter() - started)
+
+
+def profiled_iter(iterable: AsyncIterable[T], phase: str) -> AsyncIterable[T]:
+    """Time only the waits for the next item of `iterable`, not the work between them.
+
+    Returns `iterable` itself when the current request is not being profiled.
+    """
+    if _current_profile.get() is None:
+        return iterable
+    return _profiled_iter(iterable, phase)
+
+
+async def _profiled_iter(iterable: AsyncIterable[T], phase: str) -> AsyncIterator[T]:
+    iterator = aiter(iterable)
+    while True:
+        with profile_phase(phase):
+            try:
+                item = await anext(iterator)
+            except StopAsyncIteration:
+                return
+        yield item
+
+
+class ProfileStore:
+    """Profiles saved as one JSON file each in a directory shared by all workers."""
+
+    def __init__(
+        self,
+        directory: str = settings.profiling_dir,
+        max_profiles: int = settings.profiling_max_profiles,
+    ):
+        self.directory = directory
+        self.max_profiles = max_profiles
+
+    def _ids(self) -> list[str]:
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        # ids start with a timestamp, so sorting puts them in creation order
+        return sorted(
+            name[: -len(".json")]
+            for name in names
+            if name.endswith(".json") and _PROFILE_ID.match(name[: -len(".json")])
+        )
+
+    def _path(self, profile_id: str) -> str:
+        return os.path.join(self.directory, f"{profile_id}.json")
+
+    def save(self, profile: RequestProfile):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(profile.id)
+        with open(path + ".tmp", "w") as f:
+            f.write(profile.to_response().model_dump_json())
+        os.replace(path + ".tmp", path)
+        ids = self._ids()
+        for profile_id in ids[: max(0, len(ids) - self.max_profiles)]:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._path(profile_id))
+
+    def get(self, profile_id: str) -> RequestProfileResponse | None:
+        if not _PROFILE_ID.match(profile_id):
+            return None
+        try:
+            with open(self._path(profile_id)) as f:
+                return RequestProfileResponse.model_validate_json(f.read())
+        except FileNotFoundError:
+            return None
+
+    def list(self, limit: int) -> list[RequestProfileResponse]:
+        """Newest profiles first."""
+        profiles = []
+        for profile_id in reversed(self._ids()):
+            if len(profiles) >= limit:
+                break
+            profile = self.get(profile_id)
+            if profile is not None:
+                profiles.append(profile)
+        return profiles
+
+
+profile_store = ProfileStore()
+
+
+class ProfilingMiddleware:
+    """Profile sampled requests and requests asking for it with `X-Profile`.
+
+    Written as plain ASGI middleware so the profile covers the whole response,
+    including streamed bodies, and so unprofiled requests pay only for the
+    sampling decision.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        sample_rate: float = settings.profiling_sample_rate,
+        store: ProfileStore = profile_store,
+    ):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.store = store
+
+    def _trigger(self, scope: Scope) -> str | None:
+        if scope["path"].startswith(ADMIN_PATH_PREFIX):
+            return None
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                return "header" if is_admin(value) else None
+        if self.sample_rate and random.random() < self.sample_rate:
+            return "sampled"
+        return None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        trigger = self._trigger(scope) if scope["type"] == "http" else None
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope["method"], scope["path"], trigger)
+        status = None
+
+        async def send_with_profile_id(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (PROFILE_ID_HEADER, profile.id.encode())
+                ]
+            await send(message)
+
+        token = _current_profile.set(profile)
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            _current_profile.reset(token)
+            profile.finish(status)
+            try:
+                await asyncio.to_thread(self.store.save, profile)
+            except OSError as e:
+                logger.error(f"Failed to save request profile {profile.id}: {str(e)}")
+
+
+def _profiled_endpoint(endpoint: Callable) -> Callable:
+    # FastAPI reads the signature through __wrapped__, so parameters are unchanged
+    @functools.wraps(endpoint)
+    async def profiled_endpoint(*args, **kwargs):
+        profile = _current_profile.get()
+        if profile is not None and profile.handler_started is not None:
+            profile.add(PARSE_VALIDATE, time.perf_counter() - profile.handler_started)
+        try:
+            return await endpoint(*args, **kwargs)
+        finally:
+            if profile is not None:
+                profile.endpoint_finished = time.perf_counter()
+
+    return profiled_endpoint
+
+
+class ProfiledRoute(APIRoute):
+    """Route reporting body parsing and validation, and response model
+    serialization, to the current request profile."""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        if inspect.iscoroutinefunction(endpoint):
+            endpoint = _profiled_endpoint(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def profiled_handler(request: Request):
+            profile = _current_profile.get()
+            if profile is None:
+                return await handler(request)
+            profile.handler_started = time.perf_counter()
+            profile.endpoint_finished = None
+            try:
+                return await handler(request)
+            finally:
+                if profile.endpoint_finished is None:
+                    # the request was rejected before reaching the endpoint
+                    profile.add(
+                        PARSE_VALIDATE, time.perf_counter() - profile.handler_started
+                    )
+                else:
+                    profile.add(
+                        SERIALIZE, time.perf_counter() - profile.endpoint_finished
+                    )
+
+        return profiled_handler
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_profile.get() is not None:
+        conn.info.setdefault("profile_query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get("profile_query_started")
+    profile = _current_profile.get()
+    if started and profile is not None:
+        profile.add(DB, time.perf_counter() - started.pop())
+
+
+def instrument_engine(engine: Engine):
+    """Report the statements run on `engine` to the current request profile."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
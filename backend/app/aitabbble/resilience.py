@@ -0,0 +1,234 @@
+"""Resilience helpers for upstream OpenAI calls.
+
+Provides a shared circuit breaker and a tenacity wait strategy that honors
+the ``Retry-After`` hints returned by the OpenAI API.
+"""
+
+import collections
+import time
+from email.utils import parsedate_to_datetime
+from typing import Callable
+
+from tenacity import RetryCallState
+from tenacity.wait import wait_base
+
+from app.aitabbble.config import logger, settings
+
+
+def is_upstream_error(exc: BaseException) -> bool:
+    """Whether `exc` indicates an upstream OpenAI problem.
+
+    Such errors are retried and count towards the circuit breaker error rate.
+    The `openai` package is imported lazily to keep it off the startup path.
+    """
+    from openai import (
+        APIConnectionError,
+        APITimeoutError,
+        InternalServerError,
+        RateLimitError,
+    )
+
+    return isinstance(
+        exc, (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+    )
+
+
+class CircuitOpenError(Exception):
+    """Raised when a call is rejected because the circuit is open."""
+
+    def __init__(self, name: str, retry_after: float):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__(
+            f"Circuit '{name}' is open, retry in {retry_after:.1f} seconds"
+        )
+
+
+class CircuitBreaker:
+    """Error-rate based circuit breaker shared by all callers of an upstream.
+
+    The breaker keeps the outcomes of the last ``window_size`` calls. Once at
+    least ``minimum_calls`` outcomes are recorded and the failure rate reaches
+    ``failure_rate_threshold``, the circuit opens and calls fail fast with
+    ``CircuitOpenError``. After ``recovery_timeout`` seconds the circuit becomes
+    half-open and lets up to ``half_open_max_calls`` probes through: a
+    successful probe closes the circuit, a failed one opens it again.
+
+    Use it as an async context manager around a single upstream call::
+
+        async with openai_breaker:
+            response = await openai_client.chat.completions.create(...)
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate_threshold: float,
+        minimum_calls: int,
+        window_size: int,
+        recovery_timeout: float,
+        half_open_max_calls: int = 1,
+        is_failure: Callable[[BaseException], bool] = is_upstream_error,
+    ):
+        self.name = name
+        self.failure_rate_threshold = failure_rate_threshold
+        self.minimum_calls = minimum_calls
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.is_failure = is_failure
+        self._outcomes = collections.deque(maxlen=window_size)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+
+    @property
+    def state(self) -> str:
+        if (
+            self._state == self.OPEN
+            and time.monotonic() - self._opened_at >= self.recovery_timeout
+        ):
+            self._state = self.HALF_OPEN
+            self._half_open_calls = 0
+            logger.info(f"Circuit '{self.name}' is half-open, probing upstream")
+        return self._state
+
+    def retry_after(self) -> float:
+        """Seconds until the circuit may allow a call, 0 if it allows one now.
+
+        Unlike `state`, this never changes the state of the circuit.
+        """
+        if self._state == self.OPEN:
+            return max(
+                0.0, self.recovery_timeout - (time.monotonic() - self._opened_at)
+            )
+        if (
+            self._state == self.HALF_OPEN
+            and self._half_open_calls >= self.half_open_max_calls
+        ):
+            return self.recovery_timeout
+        return 0.0
+
+    def allows_call(self) -> bool:
+        """Whether `before_call` would let a call through now, without reserving it.
+
+        Meant for checks made before starting work, such as rejecting a request
+        with a 503 before its response has started.
+        """
+        return self.retry_after() <= 0
+
+    def before_call(self):
+        """Reserve a call slot or raise ``CircuitOpenError``."""
+        state = self.state
+        if state == self.OPEN:
+            raise CircuitOpenError(self.name, self.retry_after())
+        if state == self.HALF_OPEN:
+            if self._half_open_calls >= self.half_open_max_calls:
+                raise CircuitOpenError(self.name, self.recovery_timeout)
+            self._half_open_calls += 1
+
+    def record_success(self):
+        if self._state == self.HALF_OPEN:
+            logger.info(f"Circuit '{self.name}' probe succeeded, closing circuit")
+            self._reset()
+            return
+        self._outcomes.append(True)
+
+    def record_failure(self):
+        if self._state == self.HALF_OPEN:
+            logger.warning(f"Circuit '{self.name}' probe failed, reopening circuit")
+            self._open()
+            return
+        self._outcomes.append(False)
+        if len(self._outcomes) < self.minimum_calls:
+            return
+        failures = self._outcomes.count(False)
+        if failures / len(self._outcomes) >= self.failure_rate_threshold:
+            logger.error(
+                f"Circuit '{self.name}' opened after {failures}/{len(self._outcomes)} failed calls"
+            )
+            self._open()
+
+    def _open(self):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._half_open_calls = 0
+
+    def _reset(self):
+        self._state = self.CLOSED
+        self._outcomes.clear()
+        self._half_open_calls = 0
+
+    async def __aenter__(self):
+        self.before_call()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.record_success()
+        elif self.is_failure(exc):
+            self.record_failure()
+        elif self._state == self.HALF_OPEN:
+            # the probe did not reach a verdict, free its slot
+            self._half_open_calls = max(0, self._half_open_calls - 1)
+        return False
+
+
+def retry_after_seconds(exc: BaseException | None) -> float | None:
+    """Extract the ``Retry-After`` hint from an OpenAI error, if present."""
+    from openai import APIStatusError
+
+    if not isinstance(exc, APIStatusError):
+        return None
+    headers = exc.response.headers
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class wait_retry_after(wait_base):
+    """Wait for the server's ``Retry-After`` hint, or fall back to ``fallback``.
+
+    The wait never exceeds ``max_wait`` so a single hint cannot exhaust the
+    whole retry budget.
+    """
+
+    def __init__(self, fallback: wait_base, max_wait: float):
+        self.fallback = fallback
+        self.max_wait = max_wait
+
+    def __call__(self, retry_state: RetryCallState) -> float:
+        exc = retry_state.outcome.exception() if retry_state.outcome else None
+        hint = retry_after_seconds(exc)
+        if hint is None:
+            return min(self.fallback(retry_state), self.max_wait)
+        return min(hint, self.max_wait)
+
+
+# Shared breaker for every OpenAI call made by this process
+openai_breaker = CircuitBreaker(
+    name="openai",
+    failure_rate_threshold=settings.openai_circuit_failure_rate,
+    minimum_calls=settings.openai_circuit_minimum_calls,
+    window_size=settings.openai_circuit_window_size,
+    recovery_timeout=settings.openai_circuit_recovery_timeout,
+    half_open_max_calls=settings.openai_circuit_half_open_max_calls,
+)
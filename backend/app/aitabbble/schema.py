@@ -20,15 +20,52 @@ class CalculationRequest(BaseModel):
     target_cell: TargetCell
     columns: List[Column]
     data: List[dict[str, Any]]
+    # also calculate the following rows in the background, for a fill-down
+    speculate: bool = False
 
 
 class CalculationResponse(BaseModel):
     result: Any
 
 
+class CalculationBatchRequest(BaseModel):
+    requests: List[CalculationRequest] = Field(min_length=1)
+
+
+class BatchStatus(BaseModel):
+    id: str
+    status: str
+    output_file_id: str | None = None
+    error_file_id: str | None = None
+
+
+class BatchCellResult(BaseModel):
+    custom_id: str
+    row_id: str
+    column_id: str
+    result: Any = None
+    error: str | None = None
+
+
+class CalculationBatchResponse(BaseModel):
+    batch: BatchStatus
+    # the batches a large submission was split into
+    batches: List[BatchStatus] = Field(default_factory=list)
+    results: List[BatchCellResult] | None = None
+
+
+class ContentRef(BaseModel):
+    """A large value moved out of a stored message content part."""
+
+    path: List[str | int]
+    hash: str
+    size: int
+
+
 class ChatTextContent(BaseModel):
     type: str
     text: str
+    refs: List[ContentRef] = Field(default_factory=list, alias="_refs")
 
 
 class ChatToolContent(BaseModel):
@@ -37,6 +74,7 @@ class ChatToolContent(BaseModel):
     tool_call_id: str = Field(alias="toolCallId")
     args: str = Field(alias="args")
     result: Any = None
+    refs: List[ContentRef] = Field(default_factory=list, alias="_refs")
 
     @field_validator("args", mode="before")
     @classmethod
@@ -56,8 +94,14 @@ class ChatMessage(BaseModel):
     role: str
 
 
+class SheetContext(BaseModel):
+    columns: List[Column]
+    data: List[dict[str, Any]]
+
+
 class ChatRequest(BaseModel):
     messages: List[ChatMessage]
+    sheet: Optional[SheetContext] = None
 
 
 class ThreadResponse(BaseModel):
@@ -74,6 +118,22 @@ class ThreadListResponse(BaseModel):
     threads: List[ThreadResponse]
 
 
+class ThreadSummaryResponse(BaseModel):
+    id: str
+    ui_thread_id: str
+    title: str | None = None
+    archived: bool
+    message_count: int
+    last_message_at: str | None = None
+    preview: str | None = None
+    created_at: str
+    updated_at: str
+
+
+class ThreadSummaryListResponse(BaseModel):
+    threads: List[ThreadSummaryResponse]
+
+
 class ThreadCreateRequest(BaseModel):
     ui_thread_id: str
     user_id: str | None = None
@@ -100,6 +160,11 @@ class MessageResponse(BaseModel):
     updated_at: str | None = None
 
 
+class MessageContentResponse(BaseModel):
+    hash: str
+    content: str
+
+
 class MessageListResponse(BaseModel):
     messages: List[MessageResponse]
 
@@ -114,3 +179,23 @@ class MessageCreateRequest(BaseModel):
 class MessageCreateUpdateResponse(BaseModel):
     id: str
     ui_message_id: str
+
+
+class PhaseTiming(BaseModel):
+    ms: float
+    count: int
+
+
+class RequestProfileResponse(BaseModel):
+    id: str
+    method: str
+    path: str
+    status: int | None = None
+    trigger: str
+    started_at: str
+    total_ms: float
+    phases: dict[str, PhaseTiming]
+
+
+class RequestProfileListResponse(BaseModel):
+    profiles: List[RequestProfileResponse]
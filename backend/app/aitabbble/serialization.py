@@ -0,0 +1,96 @@
+"""Fast JSON serialization for API responses and stream frames.
+
+Encoding is done with pydantic-core's Rust serializer, which is already a
+dependency through pydantic and is several times faster than `json.dumps`.
+"""
+
+from typing import Any, AsyncIterator
+
+from pydantic import BaseModel
+from pydantic_core import to_json
+from starlette.responses import Response
+
+from app.aitabbble.profiling import SERIALIZE, profile_phase
+
+# Flush streamed arrays in chunks of roughly this many bytes
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def dumps(value: Any) -> str:
+    """Encode `value` as compact JSON."""
+    return to_json(value).decode()
+
+
+class ModelResponse(Response):
+    """JSON response for an already validated pydantic model.
+
+    Returning a `Response` from an endpoint makes FastAPI skip its own
+    `response_model` validation and serialization, so the model built by the
+    service layer is validated once and encoded straight to bytes.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content: BaseModel | Any) -> bytes:
+        with profile_phase(SERIALIZE):
+            return to_json(content)
+
+
+async def stream_json_array(
+    key: str, items: AsyncIterator[Any]
+) -> AsyncIterator[bytes]:
+    """Stream `{"<key>": [item, ...]}` without building the whole list in memory."""
+    buffer = bytearray(b'{' + to_json(key) + b':[')
+    first = True
+    async for item in items:
+        if not first:
+            buffer += b","
+        with profile_phase(SERIALIZE):
+            buffer += to_json(item)
+        first = False
+        if len(buffer) >= STREAM_CHUNK_SIZE:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b"]}"
+    yield bytes(buffer)
+
+
+def text_frame(text: str) -> str:
+    """Chat stream frame carrying a text delta."""
+    return '{"type":"text","text":' + dumps(text) + "}\n\n"
+
+
+class ToolFrameTemplate:
+    """Pre-encoded progress frame for a single tool call.
+
+    The parts of the frame that never change during a tool run (type, ids,
+    tool name and status objects) are encoded once; each frame only encodes
+    the arguments and the result.
+    """
+
+    def __init__(self, tool_call_id: str | None, tool_name: str | None):
+        self.prefix = (
+            '{"type":"tool-call","toolCallId":'
+            + dumps(tool_call_id)
+            + ',"toolName":'
+            + dumps(tool_name)
+            + ',"args":'
+        )
+        self._statuses = {}
+
+    def _status(self, status: str) -> str:
+        encoded = self._statuses.get(status)
+        if encoded is None:
+            status_dict = {"type": status}
+            if status == "complete":
+                status_dict["reason"] = "stop"
+            encoded = ',"status":' + dumps(status_dict)
+            self._statuses[status] = encoded
+        return encoded
+
+    def render(self, args: dict, status: str, result: Any = None) -> str:
+        # args are sent as a JSON encoded string
+        frame = self.prefix + dumps(dumps(args)) + self._status(status)
+        if result:
+            frame += ',"result":' + dumps(str(result))
+        return frame + "}\n\n"
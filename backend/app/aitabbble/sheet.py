@@ -0,0 +1,149 @@
+"""In-memory SQL view of a spreadsheet for the chat assistant.
+
+The sheet attached to a chat request is loaded into an in-memory SQLite
+database, so the model can run small read-only queries against it instead of
+receiving the whole table in its context.
+"""
+
+import asyncio
+import sqlite3
+import time
+
+from app.aitabbble.config import settings
+from app.aitabbble.schema import SheetContext
+
+TABLE_NAME = "sheet"
+ROW_ID_COLUMN = "row_id"
+
+# SQLite operations a read-only query is allowed to perform
+_ALLOWED_ACTIONS = {
+    sqlite3.SQLITE_SELECT,
+    sqlite3.SQLITE_READ,
+    sqlite3.SQLITE_FUNCTION,
+    sqlite3.SQLITE_RECURSIVE,
+}
+
+
+class SheetQueryError(Exception):
+    """Raised when a sheet query is rejected, fails or times out."""
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+class SheetDatabase:
+    """Lazily built, read-only SQLite copy of a sheet."""
+
+    def __init__(
+        self,
+        sheet: SheetContext,
+        max_rows: int = settings.sheet_query_max_rows,
+        timeout: float = settings.sheet_query_timeout_seconds,
+    ):
+        self.sheet = sheet
+        self.max_rows = max_rows
+        self.timeout = timeout
+        self.column_names = self._column_names()
+        self._conn = None
+        self._deadline = 0.0
+
+    def _column_names(self) -> dict[str, str]:
+        """Map sheet column ids to unique SQL column names based on their headers."""
+        names = {}
+        used = {ROW_ID_COLUMN}
+        for column in self.sheet.columns:
+            name = (column.header or column.id).strip() or column.id
+            candidate = name
+            suffix = 2
+            while candidate.lower() in used:
+                candidate = f"{name}_{suffix}"
+                suffix += 1
+            used.add(candidate.lower())
+            names[column.id] = candidate
+        return names
+
+    def describe(self) -> str:
+        """Schema summary for the model, without any of the sheet data."""
+        columns = ", ".join(
+            [_quote(ROW_ID_COLUMN)] + [_quote(name) for name in self.column_names.values()]
+        )
+        return (
+            f"The user's spreadsheet is available through the query_sheet tool as the "
+            f"SQLite table {_quote(TABLE_NAME)} with {len(self.sheet.data)} rows and "
+            f"the columns: {columns}. Query it instead of guessing its contents."
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(":memory:", check_same_thread=False)
+            # NUMERIC affinity stores numeric looking text as numbers
+            column_defs = ", ".join(
+                [f"{_quote(ROW_ID_COLUMN)} TEXT"]
+                + [f"{_quote(name)} NUMERIC" for name in self.column_names.values()]
+            )
+            conn.execute(f"CREATE TABLE {_quote(TABLE_NAME)} ({column_defs})")
+            placeholders = ", ".join("?" * (len(self.column_names) + 1))
+            conn.executemany(
+                f"INSERT INTO {_quote(TABLE_NAME)} VALUES ({placeholders})",
+                (
+                    [row.get("id")]
+                    + [
+                        self._sql_value(row.get(column_id))
+                        for column_id in self.column_names
+                    ]
+                    for row in self.sheet.data
+                ),
+            )
+            conn.commit()
+            conn.execute("PRAGMA query_only = ON")
+            conn.set_authorizer(self._authorize)
+            conn.set_progress_handler(self._check_deadline, 1000)
+            self._conn = conn
+        return self._conn
+
+    @staticmethod
+    def _sql_value(value):
+        if value is None or isinstance(value, (int, float, str)):
+            return value
+        return str(value)
+
+    @staticmethod
+    def _authorize(action, *args):
+        if action in _ALLOWED_ACTIONS:
+            return sqlite3.SQLITE_OK
+        return sqlite3.SQLITE_DENY
+
+    def _check_deadline(self) -> int:
+        # a non-zero return value interrupts the running query
+        return 1 if time.monotonic() > self._deadline else 0
+
+    def _run(self, query: str) -> dict:
+        conn = self._connection()
+        self._deadline = time.monotonic() + self.timeout
+        try:
+            cursor = conn.execute(query)
+            rows = cursor.fetchmany(self.max_rows + 1)
+        except sqlite3.OperationalError as e:
+            if str(e) == "interrupted":
+                raise SheetQueryError(
+                    f"query timed out after {self.timeout:.1f} seconds"
+                ) from e
+            raise SheetQueryError(str(e)) from e
+        except (sqlite3.DatabaseError, sqlite3.Warning) as e:
+            raise SheetQueryError(str(e)) from e
+        columns = [description[0] for description in cursor.description or []]
+        return {
+            "columns": columns,
+            "rows": [list(row) for row in rows[: self.max_rows]],
+            "truncated": len(rows) > self.max_rows,
+        }
+
+    async def query(self, query: str) -> dict:
+        """Run a read-only query and return at most `max_rows` rows."""
+        return await asyncio.to_thread(self._run, query)
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
@@ -0,0 +1,187 @@
+"""Speculative fill-down of AI formulas.
+
+After a formula is calculated for one cell, users usually fill it down the
+column. For requests that opt in with `speculate`, the same formula is
+calculated for the next rows in the background, at low priority, and kept
+ready keyed by row, so the fill-down requests are answered from memory.
+Speculative calls are made once, without retries, and skipped when the
+shared OpenAI limits have no room right away.
+
+Entries are keyed by a fingerprint of the sheet, so any change to the
+underlying data invalidates them. The target column itself is left out of
+the fingerprint, as filling it down is exactly what changes it.
+
+The cache is per worker process.
+"""
+
+import asyncio
+import collections
+import hashlib
+import time
+from typing import Any
+
+from app.aitabbble.config import logger, settings
+from app.aitabbble.openai_client import (
+    calculate_with_openai,
+    parse_result_value,
+    request_calculation,
+)
+from app.aitabbble.profiling import unprofiled
+from app.aitabbble.resilience import openai_breaker
+from app.aitabbble.schema import CalculationRequest
+from app.aitabbble.serialization import dumps
+
+
+def sheet_fingerprint(request: CalculationRequest) -> str:
+    """Hash of the sheet a calculation depends on, without its target column."""
+    column_id = request.target_cell.column_id
+    digest = hashlib.sha256()
+    digest.update(
+        dumps([column.model_dump() for column in request.columns]).encode()
+    )
+    for row in request.data:
+        digest.update(
+            dumps({key: value for key, value in row.items() if key != column_id}).encode()
+        )
+    return digest.hexdigest()
+
+
+class SpeculativeCalculations:
+    """Background calculations for the rows following a calculated cell."""
+
+    def __init__(
+        self,
+        rows_ahead: int = settings.speculative_rows_ahead,
+        concurrency: int = settings.speculative_concurrency,
+        max_entries: int = settings.speculative_max_entries,
+        ttl: float = settings.speculative_ttl_seconds,
+    ):
+        self.rows_ahead = rows_ahead
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # speculations past the semaphore, i.e. actually calling OpenAI
+        self._running: set[asyncio.Task] = set()
+        self._entries: collections.OrderedDict[tuple, tuple[float, asyncio.Task]] = (
+            collections.OrderedDict()
+        )
+
+    @staticmethod
+    def _key(request: CalculationRequest, fingerprint: str) -> tuple:
+        return (
+            request.formula,
+            request.target_cell.column_id,
+            request.target_cell.row_id,
+            fingerprint,
+        )
+
+    async def get(self, request: CalculationRequest) -> str | None:
+        """Return the speculated value for `request`, if one is ready or running.
+
+        A speculation still queued behind other background work is cancelled
+        instead, so the caller calculates in the foreground rather than wait.
+        """
+        key = self._key(request, sheet_fingerprint(request))
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        created_at, task = entry
+        if time.monotonic() - created_at > self.ttl:
+            self._drop(key)
+            return None
+        if not task.done() and task not in self._running:
+            self._drop(key)
+            return None
+        try:
+            # an in-flight speculation is awaited instead of being duplicated
+            value = await asyncio.shield(task)
+        except Exception:
+            self._drop(key)
+            return None
+        logger.info(
+            f"Serving speculative result for cell "
+            f"{request.target_cell.row_id}:{request.target_cell.column_id}"
+        )
+        return value
+
+    def schedule_following_rows(self, request: CalculationRequest):
+        """Start calculating the formula for the rows below the target cell."""
+        if self.rows_ahead <= 0:
+            return
+        row_ids = [row.get("id") for row in request.data]
+        try:
+            position = row_ids.index(request.target_cell.row_id)
+        except ValueError:
+            return
+        fingerprint = sheet_fingerprint(request)
+        for row_id in row_ids[position + 1 : position + 1 + self.rows_ahead]:
+            if row_id is None:
+                continue
+            speculative_request = request.model_copy(
+                update={
+                    "target_cell": request.target_cell.model_copy(
+                        update={"row_id": row_id}
+                    ),
+                    "speculate": False,
+                }
+            )
+            key = self._key(speculative_request, fingerprint)
+            if key in self._entries:
+                continue
+            with unprofiled():
+                task = asyncio.create_task(self._calculate(speculative_request))
+            task.add_done_callback(self._log_failure)
+            self._entries[key] = (time.monotonic(), task)
+        self._evict()
+
+    async def _calculate(self, request: CalculationRequest) -> str:
+        # low priority: few at a time, never while OpenAI is struggling, and a
+        # single attempt that gives up when the shared limits have no room, so
+        # speculation never takes capacity foreground calls are waiting for
+        async with self._semaphore:
+            if openai_breaker.state != openai_breaker.CLOSED:
+                raise RuntimeError("Skipping speculation while the circuit is not closed")
+            task = asyncio.current_task()
+            self._running.add(task)
+            try:
+                return await request_calculation(request, limit_timeout=0)
+            finally:
+                self._running.discard(task)
+
+    @staticmethod
+    def _log_failure(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.info(f"Speculative calculation failed: {task.exception()}")
+
+    def _drop(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is not None and not entry[1].done():
+            entry[1].cancel()
+
+    def _evict(self):
+        now = time.monotonic()
+        for key, (created_at, _) in list(self._entries.items()):
+            if now - created_at > self.ttl:
+                self._drop(key)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+
+
+speculative_calculations = SpeculativeCalculations()
+
+
+async def calculate_cell(request: CalculationRequest) -> Any:
+    """Calculate a cell value, using and feeding the speculative cache on opt-in."""
+    calculated_value = None
+    if request.speculate:
+        calculated_value = await speculative_calculations.get(request)
+
+    if calculated_value is None:
+        # Call OpenAI to calculate the value
+        calculated_value = await calculate_with_openai(request)
+
+    if request.speculate:
+        speculative_calculations.schedule_following_rows(request)
+
+    # Parse the result into appropriate type
+    return parse_result_value(calculated_value)
@@ -1,10 +1,13 @@
 import json
 import random
 import asyncio
+from contextlib import aclosing
 
-from openai import AsyncOpenAI
-
-from app.aitabbble.config import settings
+from app.aitabbble.config import logger, settings
+from app.aitabbble.limits import openai_call_slot
+from app.aitabbble.resilience import openai_breaker
+from app.aitabbble.serialization import ToolFrameTemplate, dumps
+from app.aitabbble.sheet import SheetDatabase, SheetQueryError
 
 
 class AiTool:
@@ -14,31 +17,23 @@ class AiTool:
     tool_call_id: str = None
     tool_name: str = None
     args: dict = {}
+    _frame_template: ToolFrameTemplate = None
+    _frame_template_key: str = None
 
     def report_status(self, status: str, intermediate_result=None, result=None) -> str:
         """Report the status of the tool execution."""
-        status_dict = {
-            "type": "tool-call",
-            "toolCallId": self.tool_call_id,
-            "toolName": self.tool_name,
-            "args": self.args,
-            "status": {
-                "type": status,
-            },
-        }
-        if result:
-            status_dict["result"] = str(result)
+        template = self._frame_template
+        if template is None or self._frame_template_key != self.tool_call_id:
+            template = ToolFrameTemplate(self.tool_call_id, self.tool_name)
+            self._frame_template = template
+            self._frame_template_key = self.tool_call_id
         if intermediate_result:
-            status_dict["args"].update(
+            self.args.update(
                 {
                     "result": intermediate_result,
                 }
             )
-        if status == "complete":
-            status_dict["status"]["reason"] = "stop"
-        # convert args to string
-        status_dict["args"] = json.dumps(status_dict["args"])
-        return json.dumps(status_dict) + "\n\n"
+        return template.render(self.args, status, result=result)
 
     async def run(self, args: str) -> str:
         pass
@@ -89,10 +84,13 @@ class WebSearchTool(AiTool):
             return
 
         full_result = ""
-        async for intermediate_result in self.search_query(search_query):
-            if intermediate_result:
-                full_result += intermediate_result
-                yield self.report_status("running", intermediate_result=full_result)
+        async with aclosing(self.search_query(search_query)) as search_results:
+            async for intermediate_result in search_results:
+                if intermediate_result:
+                    full_result += intermediate_result
+                    yield self.report_status(
+                        "running", intermediate_result=full_result
+                    )
 
         self.result = full_result
         yield self.report_status("complete", result=self.result)
@@ -106,18 +104,59 @@ class WebSearchTool(AiTool):
         Yield intermediate results as they are found.
         Return the final result.
         """
-        # Initialize OpenAI client
-        openai_client = AsyncOpenAI(api_key=settings.openai_api_key)
+        # imported here to avoid a circular import with openai_client
+        from app.aitabbble.openai_client import get_openai_client
+
         messages = [{"role": "user", "content": query}]
-        response = await openai_client.chat.completions.create(
-            model=settings.openai_search_model,
-            web_search_options={
-                "search_context_size": "low",
-            },
-            messages=messages,
-            stream=True,
-        )
+        async with openai_call_slot(), openai_breaker:
+            response = await get_openai_client().chat.completions.create(
+                model=settings.openai_search_model,
+                web_search_options={
+                    "search_context_size": "low",
+                },
+                messages=messages,
+                stream=True,
+            )
 
-        async for chunk in response:
-            yield chunk.choices[0].delta.content
+        try:
+            async for chunk in response:
+                yield chunk.choices[0].delta.content
+        finally:
+            # release the upstream stream right away if the search is abandoned
+            await response.close()
         return
+
+
+class SheetQueryTool(AiTool):
+    """Read-only SQL query over the spreadsheet attached to the chat."""
+
+    tool_name = "query_sheet"
+
+    def __init__(self, sheet: SheetDatabase):
+        self.sheet = sheet
+
+    async def run(self, tool_call_id: str, args: str):
+        args_dict = json.loads(args)
+        self.args = args_dict
+        self.tool_call_id = tool_call_id
+        yield self.report_status("running")
+
+        query = args_dict.get("query")
+        if not query:
+            self.result = "No query provided"
+            yield self.report_status("error", result=self.result)
+            return
+
+        try:
+            query_result = await self.sheet.query(query)
+        except SheetQueryError as e:
+            # hand the error back to the model so it can fix its query
+            self.result = f"Query failed: {e}"
+            yield self.report_status("error", result=self.result)
+            return
+
+        self.result = dumps(query_result)
+        yield self.report_status("complete", result=self.result)
+        logger.info(
+            f"Tool {self.tool_name} returned {len(query_result['rows'])} rows"
+        )
@@ -1,4 +1,28 @@
 
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("app.aitabbble.application:app", host="0.0.0.0", port=8000, reload=True)
+
+    from app.aitabbble.config import settings
+    from app.aitabbble.limits import shared_store
+
+    # Workers are spawned fresh and build their own clients in the app lifespan;
+    # start every launch from empty cross-worker counters.
+    shared_store.reset()
+
+    reload = settings.web_reload
+    if reload is None:
+        reload = settings.environment == "local" and settings.web_workers == 1
+
+    uvicorn.run(
+        "app.aitabbble.application:app",
+        host=settings.web_host,
+        port=settings.web_port,
+        workers=settings.web_workers,
+        reload=reload,
+        backlog=settings.web_backlog,
+        timeout_keep_alive=settings.web_timeout_keep_alive,
+        limit_concurrency=settings.web_limit_concurrency,
+        # let in-flight chat streams finish before a worker exits
+        timeout_graceful_shutdown=settings.chat_stream_timeout_seconds,
+    )
@@ -0,0 +1,132 @@
+"""Startup benchmark for the backend.
+
+Measures, in fresh interpreter processes, how long it takes to import the
+application, run its startup lifespan and serve the first request. Exits with
+status 1 when the median import or first-request time exceeds its threshold,
+so it can guard against startup regressions in CI.
+
+Usage:
+    cd backend
+    python scripts/benchmark_startup.py --runs 5 --max-import-ms 1200
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# Runs in a fresh interpreter so that nothing is imported or cached beforehand
+PROBE = """
+import asyncio
+import json
+import sys
+import time
+
+started = time.perf_counter()
+from app.aitabbble.application import app
+imported = time.perf_counter()
+
+
+async def first_request(path):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 0),
+        "server": ("localhost", 8000),
+    }
+    await app(scope, receive, send)
+    return messages[0]["status"]
+
+
+async def main():
+    async with app.router.lifespan_context(app):
+        ready = time.perf_counter()
+        status = await first_request(sys.argv[1])
+        served = time.perf_counter()
+    return ready, status, served
+
+
+ready, status, served = asyncio.run(main())
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "startup_ms": (ready - imported) * 1000,
+    "first_request_ms": (served - ready) * 1000,
+    "status": status,
+    "heavy_modules": sorted(
+        name for name in ("openai", "sentry_sdk", "asyncpg") if name in sys.modules
+    ),
+}))
+"""
+
+
+def run_probe(path: str) -> dict:
+    env = os.environ.copy()
+    # skip table creation and allow running without real credentials
+    env.setdefault("ENVIRONMENT", "benchmark")
+    env.setdefault("OPENAI_API_KEY", "benchmark")
+    completed = subprocess.run(
+        [sys.executable, "-c", PROBE, path],
+        cwd=BACKEND_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/health")
+    parser.add_argument("--max-import-ms", type=float, default=1200.0)
+    parser.add_argument("--max-first-request-ms", type=float, default=100.0)
+    args = parser.parse_args()
+
+    samples = [run_probe(args.path) for _ in range(args.runs)]
+    import_ms = statistics.median(s["import_ms"] for s in samples)
+    startup_ms = statistics.median(s["startup_ms"] for s in samples)
+    first_request_ms = statistics.median(s["first_request_ms"] for s in samples)
+
+    print(f"runs:           {args.runs}")
+    print(f"import:         {import_ms:8.1f} ms (max {args.max_import_ms:.0f})")
+    print(f"startup:        {startup_ms:8.1f} ms")
+    print(
+        f"first request:  {first_request_ms:8.1f} ms "
+        f"(max {args.max_first_request_ms:.0f}, status {samples[-1]['status']})"
+    )
+    print(f"heavy modules:  {', '.join(samples[-1]['heavy_modules']) or 'none'}")
+
+    failed = False
+    if import_ms > args.max_import_ms:
+        print("FAIL: import time regression")
+        failed = True
+    if first_request_ms > args.max_first_request_ms:
+        print("FAIL: first request time regression")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,10 @@
 "use client";
 
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import { SpreadsheetArea } from '@/components/SpreadsheetArea';
 import { AiSidebar } from '@/components/AiSidebar';
 import { ColumnDef, Row, SelectedCell } from '@/types/spreadsheet';
+import { setCurrentSheet } from '@/lib/sheetContext';
 
 // Initial data setup
 const initialColumns: ColumnDef[] = [
@@ -29,6 +30,12 @@ export default function Home() {
   const [selectedCell, setSelectedCell] = useState<SelectedCell | null>(null);
   const [calculatingCell, setCalculatingCell] = useState<SelectedCell | null>(null);
 
+  // Let the chat assistant query the current sheet
+  useEffect(() => {
+    setCurrentSheet({ columns, data });
+    return () => setCurrentSheet(null);
+  }, [columns, data]);
+
   const handleCellClick = (rowId: string, colId: string) => {
     setSelectedCell({ rowId, colId });
   };
@@ -73,6 +73,7 @@ export function AiSidebar({
         },
         columns,
         data,
+        speculate: process.env.NEXT_PUBLIC_SPECULATIVE_FILL_DOWN === 'true',
       };
 
       const result = await calculateFormula(request);
@@ -6,11 +6,14 @@ import { AssistantRuntimeProvider, type ChatModelAdapter, type ThreadMessage, us
 import { unstable_useRemoteThreadListRuntime as useRemoteThreadListRuntime } from "@assistant-ui/react";
 
 import { api } from "@/lib/api";
+import { channel, channelEnabled } from "@/lib/channel";
+import { getCurrentSheet } from "@/lib/sheetContext";
 import { useMemo } from "react";
 
 const MyDatabaseAdapter: RemoteThreadListAdapter = {
   async list() {
-    const response = await api.listThreads();
+    // archived threads are listed too, the sidebar groups them by status
+    const response = await api.listThreadSummaries(true);
     return {
       threads: response.threads.map((thread) => ({
         status: thread.archived ? ("archived" as const) : ("regular" as const),
@@ -140,75 +143,98 @@ const filterToolCalls = (messages: ThreadMessage[]) => {
   });
 };
 
-const MyModelAdapter: ChatModelAdapter = {
-  async *run({ messages, abortSignal }) {
+type ChatFrame = Record<string, any>;
 
-    const filteredMessages = filterToolCalls(messages as ThreadMessage[]);
+// Frames of a chat response, read from the /api/chat event stream
+async function* fetchChatFrames(
+  body: Record<string, unknown>,
+  abortSignal: AbortSignal,
+): AsyncGenerator<ChatFrame[]> {
+  const response = await fetch("http://localhost:8000/api/chat", {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify(body),
+    signal: abortSignal,
+  });
 
-    const response = await fetch("http://localhost:8000/api/chat", {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify({ messages: filteredMessages }),
-      signal: abortSignal,
-    });
+  if (!response.ok) {
+    throw new Error(`HTTP error! status: ${response.status}`);
+  }
 
-    if (!response.ok) {
-      throw new Error(`HTTP error! status: ${response.status}`);
-    }
+  if (!response.body) {
+    throw new Error("No response body");
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  try {
+    while (true) {
+      const { done, value } = await reader.read();
 
-    if (!response.body) {
-      throw new Error("No response body");
+      if (done) break;
+
+      const chunk = decoder.decode(value, { stream: true });
+      yield chunk
+        .split("\n\n")
+        .filter((chunkItem) => chunkItem.trim() !== "")
+        .map((chunkItem) => JSON.parse(chunkItem));
     }
+  } finally {
+    reader.releaseLock();
+  }
+}
+
+// Frames of a chat response, relayed over the shared WebSocket
+async function* channelChatFrames(
+  body: Record<string, unknown>,
+  abortSignal: AbortSignal,
+): AsyncGenerator<ChatFrame[]> {
+  for await (const frame of channel.chat(body, abortSignal)) {
+    yield [frame];
+  }
+}
+
+const MyModelAdapter: ChatModelAdapter = {
+  async *run({ messages, abortSignal }) {
+
+    const filteredMessages = filterToolCalls(messages as ThreadMessage[]);
+    const body = { messages: filteredMessages, sheet: getCurrentSheet() };
+    const frames = channelEnabled
+      ? channelChatFrames(body, abortSignal)
+      : fetchChatFrames(body, abortSignal);
 
-    const reader = response.body.getReader();
-    const decoder = new TextDecoder();
     let content = "";
     const toolCalls = [];
-    try {
-      while (true) {
-        const { done, value } = await reader.read();
-        
-        if (done) break;
-        
-        const chunk = decoder.decode(value, { stream: true });
-
-        const { chunkText, chunkToolCalls } = parseChunk(chunk);
-        console.log('chunkText:', chunkText);
-        console.log('chunkToolCalls:', chunkToolCalls);
-
-        if (chunkText) {
-          content += chunkText;
-        }
-        
-        if (chunkToolCalls.length > 0) {
-          toolCalls.push(...chunkToolCalls);
-        }
-
-        const currentState = {
-          content: [
-            ...(toolCalls.length > 0 ? toolCalls : []),
-            ...(content ? [{ type: "text", text: content }] : []),
-          ],
-        };
-        console.log('currentState:', currentState);
+    for await (const chunkFrames of frames) {
+      const { chunkText, chunkToolCalls } = parseFrames(chunkFrames);
+      console.log('chunkText:', chunkText);
+      console.log('chunkToolCalls:', chunkToolCalls);
 
-        yield currentState;
+      if (chunkText) {
+        content += chunkText;
+      }
+      
+      if (chunkToolCalls.length > 0) {
+        toolCalls.push(...chunkToolCalls);
       }
-    } finally {
-      reader.releaseLock();
+
+      const currentState = {
+        content: [
+          ...(toolCalls.length > 0 ? toolCalls : []),
+          ...(content ? [{ type: "text", text: content }] : []),
+        ],
+      };
+      console.log('currentState:', currentState);
+
+      yield currentState;
     }
   },
 }
 
-const parseChunk = (chunk: string) => {
+const parseFrames = (frames: ChatFrame[]) => {
   let text = "";
   const toolCalls = [];
-  const chunkItems = chunk.split("\n\n");
-  for (const chunkItem of chunkItems) {
-    if (chunkItem.trim() === "") {
-      continue;
-    }
-    const json = JSON.parse(chunkItem);
+  for (const json of frames) {
     if (json.type === "text") {
       text += json.text;
     }
@@ -246,6 +272,8 @@ export function AssistantProvider({
           () => ({
             async load() {
               if (!remoteId) return { messages: [] };
+              // large tool values arrive as previews, the server restores
+              // them when the history is sent back to the model
               const messagesResponse = await api.listMessages(remoteId);
               return {
                 messages: messagesResponse.messages.map((m, idx) => ({
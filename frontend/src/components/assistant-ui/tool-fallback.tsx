@@ -2,13 +2,16 @@ import { ToolCallContentPartComponent } from "@assistant-ui/react";
 import { CheckIcon, ChevronDownIcon, ChevronUpIcon } from "lucide-react";
 import { useState } from "react";
 import { Button } from "../ui/button";
+import { useFullContentValue } from "@/lib/messageContent";
+import { ContentRef } from "@/types/chat";
 
-export const ToolFallback: ToolCallContentPartComponent = ({
-  toolName,
-  argsText,
-  result,
-}) => {
+export const ToolFallback: ToolCallContentPartComponent = (props) => {
   const [isCollapsed, setIsCollapsed] = useState(true);
+  // stored parts carry previews; load the full values once opened
+  const refs = (props as { _refs?: ContentRef[] })._refs;
+  const { toolName } = props;
+  const { value: argsText } = useFullContentValue(refs, "argsText", props.argsText, !isCollapsed);
+  const { value: result } = useFullContentValue(refs, "result", props.result, !isCollapsed);
   return (
     <div className="mb-4 flex w-full flex-col gap-3 rounded-lg border py-3">
       <div className="flex items-center gap-2 px-4">
@@ -1,14 +1,48 @@
 import { makeAssistantToolUI } from "@assistant-ui/react";
+import { useState } from "react";
 import { Spinner } from "@/components/ui/spinner";
+import { useFullContentValue } from "@/lib/messageContent";
+import { ContentRef } from "@/types/chat";
 
 type WebSearchArgs = {
   search_query: string;
   result?: string;
 };
 
+// Results of stored messages are previews until the user asks for more
+const WebSearchResult = ({
+  args,
+  result,
+  refs,
+}: {
+  args: WebSearchArgs;
+  result: string;
+  refs?: ContentRef[];
+}) => {
+  const [showFull, setShowFull] = useState(false);
+  const { value, isPreview } = useFullContentValue(refs, "result", result, showFull);
+  return (
+    <div className="rounded-lg bg-blue-50 p-4 mb-4">
+      <h3 className="text-lg font-bold">Web Search Results</h3>
+      <p className="text-sm text-gray-500 mb-3">Search term: &quot;{args.search_query}&quot;</p>
+      <div className="mt-2 text-sm text-gray-600 whitespace-pre-wrap">
+        {value}
+      </div>
+      {isPreview && (
+        <button
+          className="mt-2 text-sm text-blue-600 hover:underline"
+          onClick={() => setShowFull(true)}
+        >
+          Show full results
+        </button>
+      )}
+    </div>
+  );
+};
+
 const WebSearchToolUI = makeAssistantToolUI<WebSearchArgs, string>({
   toolName: "web_search",
-  render: ({ args, status, result }) => {
+  render: ({ args, status, result, ...part }) => {
     // Workaround for streaming the intermediate results. Try taking them from the args.
     
     if (status.type === "running") {
@@ -33,13 +67,11 @@ const WebSearchToolUI = makeAssistantToolUI<WebSearchArgs, string>({
     }
     else if (status.type === "complete") {      
       return result ? (
-        <div className="rounded-lg bg-blue-50 p-4 mb-4">
-          <h3 className="text-lg font-bold">Web Search Results</h3>
-          <p className="text-sm text-gray-500 mb-3">Search term: &quot;{args.search_query}&quot;</p>
-          <div className="mt-2 text-sm text-gray-600 whitespace-pre-wrap">
-            {result}
-          </div>
-        </div>
+        <WebSearchResult
+          args={args}
+          result={result}
+          refs={(part as { _refs?: ContentRef[] })._refs}
+        />
       ) : null;
     }
     return null;
@@ -4,10 +4,13 @@ import {
   ThreadUpdateRequest,
   ThreadCreateUpdateResponse,
   ThreadListResponse,
+  ThreadSummaryListResponse,
   MessageCreateRequest,
   MessageCreateUpdateResponse,
   MessageListResponse,
+  MessageContentResponse,
 } from '@/types/chat';
+import { channel, channelEnabled } from '@/lib/channel';
 
 // Configuration
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
@@ -23,20 +26,26 @@ export class ApiError extends Error {
 // API functions
 export async function calculateFormula(request: CalculateRequest): Promise<CalculateResponse> {
   try {
-    const response = await fetch(`${API_BASE_URL}/api/calculate`, {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify(request),
-    });
-
-    if (!response.ok) {
-      throw new Error('Request failed');
+    let result: CalculateResponse;
+    if (channelEnabled) {
+      // Reuse the open WebSocket instead of a new HTTP request per cell
+      result = await channel.calculate(request);
+    } else {
+      const response = await fetch(`${API_BASE_URL}/api/calculate`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(request),
+      });
+
+      if (!response.ok) {
+        throw new Error('Request failed');
+      }
+
+      result = await response.json();
     }
 
-    const result = await response.json();
-
     if (result.error) {
       throw new Error(result.error);
     }
@@ -121,6 +130,27 @@ export async function listThreads(): Promise<ThreadListResponse> {
   }
 }
 
+// Threads with message count, last activity and preview, in a single request
+export async function listThreadSummaries(includeArchived = false): Promise<ThreadSummaryListResponse> {
+  try {
+    const response = await fetch(`${API_BASE_URL}/api/threads/summary?include_archived=${includeArchived}`, {
+      method: 'GET',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+    });
+
+    if (!response.ok) {
+      throw new Error('Failed to fetch thread summaries');
+    }
+
+    const result = await response.json();
+    return result;
+  } catch {
+    throw new ApiError('Failed to fetch threads. Please try again.');
+  }
+}
+
 // Message API functions
 export async function createMessage(request: MessageCreateRequest): Promise<MessageCreateUpdateResponse> {
   try {
@@ -163,13 +193,37 @@ export async function listMessages(threadId: string): Promise<MessageListRespons
   }
 }
 
+// Large message content values are returned as previews by listMessages;
+// fetch the full value by the hash listed in the content part's `_refs`.
+export async function getMessageContent(hash: string): Promise<MessageContentResponse> {
+  try {
+    const response = await fetch(`${API_BASE_URL}/api/message/content/${encodeURIComponent(hash)}`, {
+      method: 'GET',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+    });
+
+    if (!response.ok) {
+      throw new Error('Failed to fetch message content');
+    }
+
+    const result = await response.json();
+    return result;
+  } catch {
+    throw new ApiError('Failed to fetch message content. Please try again.');
+  }
+}
+
 // Add more API functions here as needed
 export const api = {
   calculateFormula,
   createThread,
   updateThread,
   listThreads,
+  listThreadSummaries,
   createMessage,
   listMessages,
+  getMessageContent,
   // Future API methods can be added here
 }; 
\ No newline at end of file
@@ -0,0 +1,161 @@
+import { CalculateRequest, CalculateResponse } from '@/types/spreadsheet';
+
+// Single WebSocket to the backend (`/api/ws`) carrying calculations and chat
+// streams, each tagged with a request id. Enabled with
+// NEXT_PUBLIC_USE_WEBSOCKET=true.
+
+const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
+const CHANNEL_URL = API_BASE_URL.replace(/^http/, 'ws') + '/api/ws';
+
+export interface ChannelMessage {
+  id: string | null;
+  type: 'result' | 'chat' | 'done' | 'cancelled' | 'error';
+  result?: CalculateResponse['result'];
+  frame?: Record<string, unknown>;
+  status?: number;
+  detail?: unknown;
+  retry_after?: number;
+}
+
+export class ChannelError extends Error {
+  status?: number;
+  retryAfter?: number;
+
+  constructor(message: string, status?: number, retryAfter?: number) {
+    super(message);
+    this.name = 'ChannelError';
+    this.status = status;
+    this.retryAfter = retryAfter;
+  }
+}
+
+type Listener = (message: ChannelMessage) => void;
+
+class Channel {
+  private socket: WebSocket | null = null;
+  private opening: Promise<WebSocket> | null = null;
+  private listeners = new Map<string, Listener>();
+  private nextId = 0;
+
+  private connect(): Promise<WebSocket> {
+    if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+      return Promise.resolve(this.socket);
+    }
+    if (!this.opening) {
+      this.opening = new Promise((resolve, reject) => {
+        const socket = new WebSocket(CHANNEL_URL);
+        socket.onopen = () => {
+          this.socket = socket;
+          this.opening = null;
+          resolve(socket);
+        };
+        socket.onerror = () => {
+          this.opening = null;
+          reject(new ChannelError('Could not connect to the server'));
+        };
+        socket.onmessage = (event) => {
+          const message: ChannelMessage = JSON.parse(event.data);
+          if (message.id !== null) {
+            this.listeners.get(message.id)?.(message);
+          }
+        };
+        socket.onclose = () => {
+          this.socket = null;
+          // Fail everything that was waiting on this connection
+          this.listeners.forEach((listener, id) =>
+            listener({ id, type: 'error', detail: 'Connection closed' }),
+          );
+          this.listeners.clear();
+        };
+      });
+    }
+    return this.opening;
+  }
+
+  private async request(
+    payload: Record<string, unknown>,
+    listener: Listener,
+  ): Promise<string> {
+    const socket = await this.connect();
+    const id = String(++this.nextId);
+    this.listeners.set(id, listener);
+    socket.send(JSON.stringify({ id, ...payload }));
+    return id;
+  }
+
+  private finish(id: string) {
+    this.listeners.delete(id);
+  }
+
+  cancel(id: string) {
+    this.socket?.send(JSON.stringify({ id, type: 'cancel' }));
+  }
+
+  calculate(request: CalculateRequest): Promise<CalculateResponse> {
+    return new Promise((resolve, reject) => {
+      this.request({ type: 'calculate', request }, (message) => {
+        if (message.type === 'result') {
+          this.finish(message.id!);
+          resolve({ result: message.result ?? null });
+        } else if (message.type === 'error' || message.type === 'cancelled') {
+          this.finish(message.id!);
+          reject(toError(message));
+        }
+      }).catch(reject);
+    });
+  }
+
+  // Yields the frames of a chat response (same as the /api/chat stream) as
+  // they arrive. Aborting `signal` cancels the request on the server.
+  async *chat(
+    request: Record<string, unknown>,
+    signal?: AbortSignal,
+  ): AsyncGenerator<Record<string, unknown>> {
+    const pending: ChannelMessage[] = [];
+    let notify: (() => void) | null = null;
+    const id = await this.request({ type: 'chat', request }, (message) => {
+      pending.push(message);
+      notify?.();
+    });
+    const onAbort = () => this.cancel(id);
+    signal?.addEventListener('abort', onAbort);
+    if (signal?.aborted) onAbort();
+    let finished = false;
+    try {
+      while (true) {
+        if (pending.length === 0) {
+          await new Promise<void>((resolve) => {
+            notify = resolve;
+          });
+          notify = null;
+          continue;
+        }
+        const message = pending.shift()!;
+        if (message.type === 'chat') {
+          yield message.frame!;
+        } else if (message.type === 'done') {
+          finished = true;
+          return;
+        } else if (message.type === 'error' || message.type === 'cancelled') {
+          finished = true;
+          if (signal?.aborted) return;
+          throw toError(message);
+        }
+      }
+    } finally {
+      signal?.removeEventListener('abort', onAbort);
+      // stop the server side when the reader gives up early
+      if (!finished) this.cancel(id);
+      this.finish(id);
+    }
+  }
+}
+
+function toError(message: ChannelMessage): ChannelError {
+  const detail = typeof message.detail === 'string' ? message.detail : message.type;
+  return new ChannelError(detail, message.status, message.retry_after);
+}
+
+export const channel = new Channel();
+
+export const channelEnabled = process.env.NEXT_PUBLIC_USE_WEBSOCKET === 'true';
@@ -0,0 +1,36 @@
+import { useEffect, useState } from 'react';
+import { api } from '@/lib/api';
+import { ContentRef } from '@/types/chat';
+
+// Stored messages are loaded with previews of their large values, each listed
+// under the content part's `_refs` (see `listMessages`). Returns the full value
+// of the top-level field `key` once `enabled`, e.g. when the user opens a tool
+// result, and `value` itself until then or when it is not a preview.
+export function useFullContentValue<T>(
+  refs: ContentRef[] | undefined,
+  key: string,
+  value: T,
+  enabled: boolean,
+): { value: T | string; isPreview: boolean } {
+  const hash = refs?.find((ref) => ref.path.length === 1 && ref.path[0] === key)?.hash;
+  const [fullValue, setFullValue] = useState<string>();
+
+  useEffect(() => {
+    if (!enabled || !hash || fullValue !== undefined) return;
+    let cancelled = false;
+    api
+      .getMessageContent(hash)
+      .then((response) => {
+        if (!cancelled) setFullValue(response.content);
+      })
+      .catch((error) => console.error(error));
+    return () => {
+      cancelled = true;
+    };
+  }, [enabled, hash, fullValue]);
+
+  return {
+    value: fullValue ?? value,
+    isPreview: hash !== undefined && fullValue === undefined,
+  };
+}
@@ -0,0 +1,18 @@
+import { ColumnDef, Row } from '@/types/spreadsheet';
+
+// Snapshot of the spreadsheet shared with the chat assistant, which lives
+// outside the page component tree.
+export interface SheetSnapshot {
+  columns: ColumnDef[];
+  data: Row[];
+}
+
+let currentSheet: SheetSnapshot | null = null;
+
+export function setCurrentSheet(sheet: SheetSnapshot | null) {
+  currentSheet = sheet;
+}
+
+export function getCurrentSheet(): SheetSnapshot | null {
+  return currentSheet;
+}
@@ -32,6 +32,22 @@ export interface ThreadListResponse {
   threads: ThreadResponse[];
 }
 
+export interface ThreadSummaryResponse {
+  id: string;
+  ui_thread_id: string;
+  title: string | null;
+  archived: boolean;
+  message_count: number;
+  last_message_at: string | null;
+  preview: string | null;
+  created_at: string;
+  updated_at: string;
+}
+
+export interface ThreadSummaryListResponse {
+  threads: ThreadSummaryResponse[];
+}
+
 // Message types
 export interface MessageCreateRequest {
   ui_message_id: string;
@@ -55,6 +71,19 @@ export interface MessageResponse {
   updated_at: string;
 }
 
+// A large value of a stored content part, replaced by a preview and listed
+// under the part's `_refs`
+export interface ContentRef {
+  path: (string | number)[];
+  hash: string;
+  size: number;
+}
+
+export interface MessageContentResponse {
+  hash: string;
+  content: string;
+}
+
 export interface MessageListResponse {
   messages: MessageResponse[];
 } 
\ No newline at end of file
@@ -40,6 +40,8 @@ export interface CalculateRequest {
   };
   columns: ColumnDef[];
   data: Row[];
+  // Precompute the rows below in the background, for a fill-down
+  speculate?: boolean;
 }
 
 export interface CalculateResponse {